@@ -0,0 +1,185 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+from database import DB_NAME, LOG_TYPE_NAMES
+
+# Выгрузка и отчёты по всем пользователям. Работает через отдельное соединение
+# только для чтения: в режиме WAL читатель видит снимок базы на начало
+# транзакции и не мешает боту писать. Строки идут потоком пачками по
+# EXPORT_CHUNK, поэтому память не зависит от числа пользователей
+
+EXPORT_CHUNK = 10000
+# Кэш страниц соединения (КиБ): ограничивает память SQLite на больших выборках
+CACHE_KIB = 16384
+
+USER_COLUMNS = ('user_id', 'weight', 'height', 'age', 'activity', 'city',
+                'water_goal', 'calorie_goal', 'timezone')
+LOG_COLUMNS = ('id', 'user_id', 'type', 'name', 'quantity', 'amount', 'created_at', 'day')
+# Типы колонок Parquet задаются заранее: в пачке из одной воды name целиком NULL
+PARQUET_TYPES = {'id': 'int64', 'user_id': 'int64', 'age': 'int64', 'activity': 'int64',
+                 'city': 'string', 'timezone': 'string', 'type': 'string', 'name': 'string',
+                 'created_at': 'string', 'day': 'string'}
+
+def connect(db_path=DB_NAME):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    conn.execute(f'PRAGMA cache_size = -{CACHE_KIB}')
+    # Все запросы выгрузки читают один и тот же снимок базы
+    conn.execute('BEGIN')
+    return conn
+
+def _iter_rows(conn, query, params=(), chunk=EXPORT_CHUNK):
+    cur = conn.execute(query, params)
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            return
+        yield rows
+
+def iter_users(conn, chunk=EXPORT_CHUNK):
+    yield from _iter_rows(conn, f'SELECT {", ".join(USER_COLUMNS)} FROM users ORDER BY user_id', chunk=chunk)
+
+def iter_logs(conn, since=None, chunk=EXPORT_CHUNK):
+    # since - первый локальный день ГГГГ-ММ-ДД; логи идут в порядке id, без сортировки
+    since_number = int(since.replace('-', '')) if since else 0
+    for rows in _iter_rows(conn, '''
+    SELECT l.id, l.user_id, l.type, n.name, l.quantity, l.amount,
+        DATETIME(l.created_at, 'unixepoch'),
+        SUBSTR(l.day, 1, 4) || '-' || SUBSTR(l.day, 5, 2) || '-' || SUBSTR(l.day, 7, 2)
+    FROM logs l
+    LEFT JOIN log_names n ON n.id = l.name_id
+    WHERE l.day >= ?
+    ORDER BY l.id
+    ''', (since_number,), chunk):
+        yield [(row[0], row[1], LOG_TYPE_NAMES.get(row[2])) + row[3:] for row in rows]
+
+def _open_text(path):
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', compresslevel=6, encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def write_csv(path, columns, chunks):
+    count = 0
+    stream = _open_text(path)
+    try:
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return count
+
+def write_jsonl(path, columns, chunks):
+    count = 0
+    stream = _open_text(path)
+    try:
+        for rows in chunks:
+            stream.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return count
+
+def write_parquet(path, columns, chunks):
+    # pyarrow нужен только для Parquet и в requirements.txt не входит
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для выгрузки в Parquet установите pyarrow: pip install pyarrow")
+
+    schema = pa.schema([(name, getattr(pa, PARQUET_TYPES.get(name, 'float64'))()) for name in columns])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            # Каждая пачка становится отдельной группой строк файла
+            writer.write_table(pa.table([list(values) for values in zip(*rows)], schema=schema))
+            count += len(rows)
+    return count
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+def _format_for(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lstrip('.')
+    return extension if extension in WRITERS else 'csv'
+
+def export(conn, table, path, fmt=None, since=None, chunk=EXPORT_CHUNK):
+    fmt = fmt or _format_for(path)
+    if table == 'users':
+        return WRITERS[fmt](path, USER_COLUMNS, iter_users(conn, chunk))
+    return WRITERS[fmt](path, LOG_COLUMNS, iter_logs(conn, since, chunk))
+
+def _since(days):
+    return (date.today() - timedelta(days=days - 1)).isoformat()
+
+def daily_active_users(conn, days=30):
+    # В daily_summary одна строка на пользователя и день с записями,
+    # поэтому активные за день - это просто число строк
+    return conn.execute('''
+    SELECT day, COUNT(*) FROM daily_summary
+    WHERE day >= ?
+    GROUP BY day
+    ORDER BY day
+    ''', (_since(days),)).fetchall()
+
+def water_adherence_by_city(conn, days=30):
+    # Доля нормы воды за активный день (не больше 1), в среднем по дням и пользователям города
+    return conn.execute('''
+    SELECT COALESCE(u.city, ''), COUNT(DISTINCT u.user_id), COUNT(*),
+        ROUND(AVG(MIN(s.water * 1.0 / u.water_goal, 1.0)), 3)
+    FROM daily_summary s
+    JOIN users u ON u.user_id = s.user_id
+    WHERE s.day >= ? AND u.water_goal > 0
+    GROUP BY u.city
+    ORDER BY COUNT(DISTINCT u.user_id) DESC
+    ''', (_since(days),)).fetchall()
+
+REPORTS = {
+    'dau': (daily_active_users, ('day', 'active_users')),
+    'water': (water_adherence_by_city, ('city', 'users', 'active_days', 'water_adherence')),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Выгрузка данных и отчёты по всем пользователям')
+    parser.add_argument('--db', default=DB_NAME, help='файл базы (по умолчанию %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    exporter = commands.add_parser('export', help='выгрузить таблицу (.csv, .jsonl, можно .gz; .parquet - нужен pyarrow)')
+    exporter.add_argument('table', choices=('users', 'logs'))
+    exporter.add_argument('output', help='файл или - для stdout')
+    exporter.add_argument('--format', choices=tuple(WRITERS), help='по умолчанию - по расширению файла')
+    exporter.add_argument('--since', help='логи начиная с локального дня ГГГГ-ММ-ДД')
+    exporter.add_argument('--chunk', type=int, default=EXPORT_CHUNK, help='строк в пачке')
+
+    report = commands.add_parser('report', help='отчёт: dau - активные пользователи по дням, water - норма воды по городам')
+    report.add_argument('name', choices=tuple(REPORTS))
+    report.add_argument('--days', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        if args.command == 'export':
+            start = time.perf_counter()
+            count = export(conn, args.table, args.output, args.format, args.since, args.chunk)
+            print(f"✅ Выгружено строк: {count} за {time.perf_counter() - start:.1f} с", file=sys.stderr)
+        else:
+            query, columns = REPORTS[args.name]
+            write_csv('-', columns, [query(conn, args.days)])
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
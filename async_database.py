@@ -0,0 +1,108 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from metrics import DB_LATENCY, DB_ERRORS, timed
+
+def _create_executors():
+    global _writer, _readers, _maintenance
+    # Все записи идут через один поток, чтобы не конкурировать за блокировку SQLite,
+    # чтения - через остальные соединения пула.
+    _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+    _readers = ThreadPoolExecutor(max_workers=max(1, database.POOL_SIZE - 1), thread_name_prefix='db-reader')
+    # Чистка старых логов идёт короткими транзакциями в своём потоке и не занимает
+    # поток писателя на всё время работы
+    _maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-maintenance')
+
+_create_executors()
+# Потоки пулов не переживают fork: если родитель уже ими пользовался, задачи
+# воркера (workers.py) ждали бы несуществующие потоки
+os.register_at_fork(after_in_child=_create_executors)
+
+@functools.lru_cache(maxsize=None)
+def _timed(func):
+    # Время замеряется внутри потока пула, без ожидания в очереди исполнителя
+    return timed(DB_LATENCY, func.__name__, errors=DB_ERRORS)(func)
+
+async def _run(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_timed(func), *args, **kwargs))
+
+async def init_db():
+    return await _run(_writer, database.init_db)
+
+async def close_db():
+    # close_db ставится в очередь писателя последним, поэтому все ранее
+    # отправленные записи успевают завершиться. Чистка логов прерывается после
+    # текущей пачки
+    database.stop_maintenance()
+    await asyncio.get_running_loop().run_in_executor(_maintenance, database.stop_maintenance)
+    return await _run(_writer, database.close_db)
+
+async def save_user(user_id, **data):
+    return await _run(_writer, database.save_user, user_id, **data)
+
+async def get_user(user_id):
+    return await _run(_readers, database.get_user, user_id)
+
+async def add_log(user_id, log_type, value, amount, quantity=None):
+    return await _run(_writer, database.add_log, user_id, log_type, value, amount, quantity)
+
+async def get_today_stats(user_id):
+    return await _run(_readers, database.get_today_stats, user_id)
+
+async def clear_user_logs(user_id):
+    return await _run(_writer, database.clear_user_logs, user_id)
+
+async def flush_logs():
+    return await _run(_writer, database.flush_logs)
+
+# История читает только записанные логи, поэтому очередь отложенной записи
+# сначала сбрасывается в потоке писателя, а само чтение идёт в потоке читателя
+async def get_user_history(user_id, days=7):
+    if database.BATCH_WRITES:
+        await flush_logs()
+    return await _run(_readers, database.get_user_history, user_id, days)
+
+async def get_daily_summaries(user_id, days=7):
+    if database.BATCH_WRITES:
+        await flush_logs()
+    return await _run(_readers, database.get_daily_summaries, user_id, days)
+
+async def delete_user(user_id):
+    return await _run(_writer, database.delete_user, user_id)
+
+async def reset_daily_data(user_id):
+    return await _run(_writer, database.reset_daily_data, user_id)
+
+async def get_all_users():
+    return await _run(_readers, database.get_all_users)
+
+async def save_food_cache(query, calories):
+    return await _run(_writer, database.save_food_cache, query, calories)
+
+async def load_food_cache():
+    return await _run(_readers, database.load_food_cache)
+
+async def get_fsm_record(key):
+    return await _run(_readers, database.get_fsm_record, key)
+
+async def set_fsm_state(key, state):
+    return await _run(_writer, database.set_fsm_state, key, state)
+
+async def set_fsm_data(key, data):
+    return await _run(_writer, database.set_fsm_data, key, data)
+
+async def delete_expired_fsm(updated_before):
+    return await _run(_writer, database.delete_expired_fsm, updated_before)
+
+async def count_fsm_sessions(updated_after):
+    return await _run(_readers, database.count_fsm_sessions, updated_after)
+
+async def purge_old_logs():
+    return await _run(_maintenance, database.purge_old_logs)
+
+async def get_db_size():
+    return await _run(_readers, database.get_db_size)
@@ -1,12 +1,18 @@
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram import BaseMiddleware
 from aiogram.types import Update, Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
 import asyncio
 import logging
-import sys
+import multiprocessing
+import secrets
+import signal
+import time
 import os
-from datetime import datetime
+from datetime import date
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,67 +22,150 @@ if not TELEGRAM_TOKEN:
     print("❌ TELEGRAM_TOKEN не найден. Бот не запустится.")
     exit(1)
 
-from database import init_db, save_user, get_user, add_log, get_today_stats, clear_user_logs
-from utils import get_weather, get_calories, calculate_goals, calculate_burned_calories
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from config import METRICS_HOST, METRICS_PORT, BOT_MODE, BOT_WORKERS, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SHUTDOWN_TIMEOUT, RETENTION_DAYS, RETENTION_INTERVAL
+from async_database import init_db, close_db, save_user, get_user, add_log, get_today_stats, get_daily_summaries, clear_user_logs, count_fsm_sessions, purge_old_logs, get_db_size
+from fsm_storage import SQLiteStorage
+from log_config import setup_logging
+from ratelimit import RateLimitMiddleware, OutgoingThrottle
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS, WIZARD_SESSIONS, DB_SIZE, start_metrics_server
+from utils import init_http, close_http, warm_food_cache, get_weather_async, get_calories_async, find_local_food, calculate_goals, calculate_burned_calories
+
 logger = logging.getLogger(__name__)
+# Запись на каждый апдейт; сэмплируется через LOG_SAMPLE_RATE
+message_logger = logging.getLogger('bot.messages')
 
 bot = Bot(token=TELEGRAM_TOKEN)
-dp = Dispatcher()
+storage = SQLiteStorage()
+dp = Dispatcher(storage=storage)
+metrics_runner = None
+retention_task = None
 
-user_state = {}
+class ProfileForm(StatesGroup):
+    weight = State()
+    height = State()
+    age = State()
+    activity = State()
+    city = State()
 
 class LoggingMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Update, data: dict):
         try:
             if isinstance(event, Update) and event.message:
                 user = event.message.from_user
-                user_id = user.id
-                username = user.username or "без username"
-                first_name = user.first_name or ""
-                last_name = user.last_name or ""
-                full_name = f"{first_name} {last_name}".strip()
-                
                 text = event.message.text or ""
-                chat_id = event.message.chat.id
+                # Имя команды без аргументов и @username бота, чтобы логи группировались по командам
+                command = text.split()[0].split('@')[0] if text.startswith('/') else None
                 
-                logger.info(
-                    f"📨 Сообщение от пользователя: "
-                    f"ID={user_id}, "
-                    f"Username=@{username}, "
-                    f"Имя='{full_name}', "
-                    f"Чат ID={chat_id}, "
-                    f"Текст='{text}'"
+                message_logger.info(
+                    "📨 Сообщение от пользователя: ID=%s, Username=@%s, Имя='%s', Чат ID=%s, Текст='%s'",
+                    user.id, user.username or "без username", user.full_name, event.message.chat.id, text,
+                    extra={'user_id': user.id, 'chat_id': event.message.chat.id, 'command': command}
                 )
-                
-                if text.startswith('/'):
-                    logger.info(f"🚀 Команда: {text}")
             
             elif isinstance(event, Update) and event.callback_query:
                 user = event.callback_query.from_user
-                user_id = user.id
-                data_text = event.callback_query.data or ""
-                
-                logger.info(f"🔄 Callback от пользователя {user_id}: {data_text}")
+                message_logger.info(
+                    "🔄 Callback от пользователя %s: %s", user.id, event.callback_query.data or "",
+                    extra={'user_id': user.id}
+                )
         
         except Exception as e:
-            logger.error(f"Ошибка в middleware: {e}")
+            logger.error("Ошибка в middleware: %s", e)
         
         return await handler(event, data)
 
+# Лимитер стоит первым, чтобы флуд отбрасывался до логирования и обработки
+dp.update.middleware(RateLimitMiddleware())
 dp.update.middleware(LoggingMiddleware())
+bot.session.middleware(OutgoingThrottle())
+
+def metrics_label(message, raw_state):
+    # Метка ограничена известными командами и шагами анкеты, чтобы число рядов не росло
+    text = message.text or ""
+    if text.startswith('/'):
+        name = text.split(maxsplit=1)[0].split('@')[0].lower()
+        return name if name in COMMANDS else 'unknown'
+    return raw_state or 'text'
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event: Message, data: dict):
+        label = metrics_label(event, data.get('raw_state'))
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, label)
+
+dp.message.middleware(MetricsMiddleware())
+
+async def refresh_metrics():
+    WIZARD_SESSIONS.set(await count_fsm_sessions(time.time() - storage.ttl))
+    size = await get_db_size()
+    DB_SIZE.set(size['bytes'], 'total')
+    DB_SIZE.set(size['free_bytes'], 'free')
+
+async def retention_loop():
+    while True:
+        if RETENTION_DAYS > 0:
+            try:
+                deleted = await purge_old_logs()
+                if deleted:
+                    logger.info("🗄 Удалено логов старше %s дн.: %s", RETENTION_DAYS, deleted)
+            except Exception as e:
+                logger.error("Ошибка очистки старых логов: %s", e)
+        try:
+            expired = await storage.purge_expired()
+            if expired:
+                logger.info("🗂 Удалено устаревших состояний анкеты: %s", expired)
+        except Exception as e:
+            logger.error("Ошибка очистки состояний анкеты: %s", e)
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+def start_retention():
+    return asyncio.create_task(retention_loop())
+
+# Реестр команд: имя -> обработчик(message, args, state)
+COMMANDS = {}
+
+def command(*names):
+    def register(handler):
+        for name in names:
+            COMMANDS[name] = handler
+        return handler
+    return register
 
-@dp.message(Command("start"))
-async def start(message: types.Message):
-    logger.info(f"Пользователь {message.from_user.id} начал работу с ботом")
+# Регистрируется до шагов анкеты, чтобы команды работали и посреди /setprofile
+@dp.message(F.text.startswith('/'))
+async def route_command(message: types.Message, state: FSMContext):
+    uid = message.from_user.id
+    parts = message.text.split()
+    name = parts[0].lower().split('@')[0]
+    handler = COMMANDS.get(name)
+    
+    if handler is None:
+        await message.answer(
+            "❌ Неизвестная команда\n\n"
+            "📋 Правильные команды:\n"
+            "/water 500 - записать воду\n"
+            "/food яблоко 200 - записать еду\n"
+            "/workout бег 30 - записать тренировку\n"
+            "/start - все команды"
+        )
+        return
+    
+    try:
+        await handler(message, parts[1:], state)
+    except Exception as e:
+        HANDLER_ERRORS.inc(name)
+        logger.error("Общая ошибка обработки команды от пользователя %s: %s", uid, e)
+        await message.answer("❌ Произошла ошибка при обработке команды")
+
+@command("/start")
+async def start(message: types.Message, args, state: FSMContext):
+    logger.debug("Пользователь %s начал работу с ботом", message.from_user.id)
     await message.answer(
         "🤖 Бот для контроля здоровья\n\n"
         "📋 Команды:\n"
@@ -86,43 +175,45 @@ async def start(message: types.Message):
         "/food яблоко 200 - записать еду\n"
         "/workout бег 30 - записать тренировку\n"
         "/progress - прогресс за сегодня\n"
+        "/week, /month - история за неделю и месяц\n"
         "/tips - рекомендации\n"
         "/reset - сбросить мои данные\n"
         "/help - помощь по командам"
     )
 
-@dp.message(Command("help"))
-async def help_cmd(message: types.Message):
-    logger.info(f"Пользователь {message.from_user.id} запросил помощь")
+@command("/help")
+async def help_cmd(message: types.Message, args, state: FSMContext):
+    logger.debug("Пользователь %s запросил помощь", message.from_user.id)
     await message.answer(
         "❓ Помощь по командам:\n\n"
         "💧 /water 500 - запишите количество воды в мл\n"
         "🍎 /food яблоко 200 - запишите еду (название и граммы)\n"
         "🏃 /workout бег 30 - запишите тренировку (тип и минуты)\n"
         "📊 /progress - посмотрите свой прогресс\n"
+        "📅 /history 14 - итоги по дням (/week - 7 дней, /month - 30)\n"
         "💡 /tips - персонализированные рекомендации\n"
         "👤 /profile - информация о профиле\n"
         "🔄 /reset - сбросить все данные"
     )
 
-@dp.message(Command("reset"))
-async def reset_cmd(message: types.Message):
+@command("/reset")
+async def reset_cmd(message: types.Message, args, state: FSMContext):
     uid = message.from_user.id
-    logger.info(f"Пользователь {uid} сбросил данные")
-    clear_user_logs(uid)
+    logger.info("Пользователь %s сбросил данные", uid)
+    await clear_user_logs(uid)
     await message.answer("✅ Ваши данные сброшены. Создайте новый профиль: /setprofile")
 
-@dp.message(Command("profile"))
-async def show_profile(message: types.Message):
+@command("/profile")
+async def show_profile(message: types.Message, args, state: FSMContext):
     uid = message.from_user.id
-    logger.info(f"Пользователь {uid} запросил профиль")
-    user = get_user(uid)
+    logger.debug("Пользователь %s запросил профиль", uid)
+    user = await get_user(uid)
     
     if not user:
         await message.answer("❌ Сначала создайте профиль: /setprofile")
         return
     
-    temp = get_weather(user['city'])
+    temp = await get_weather_async(user['city'])
     
     await message.answer(
         f"👤 Ваш профиль:\n\n"
@@ -139,48 +230,49 @@ async def show_profile(message: types.Message):
         f"• Калории: {user['calorie_goal']} ккал"
     )
 
-@dp.message(Command("setprofile"))
-async def start_profile(message: types.Message):
+@command("/setprofile")
+async def start_profile(message: types.Message, args, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} начал создание профиля")
+    logger.info("Пользователь %s начал создание профиля", user_id)
     
-    clear_user_logs(user_id)
+    await clear_user_logs(user_id)
     
-    user_state[user_id] = {'step': 'weight'}
+    await state.set_data({})
+    await state.set_state(ProfileForm.weight)
     await message.answer("📝 Создание профиля\n\nШаг 1 из 5: Введите ваш вес (кг):")
 
-@dp.message(lambda m: m.from_user.id in user_state and user_state[m.from_user.id]['step'] == 'weight')
-async def process_weight(message: types.Message):
+@dp.message(ProfileForm.weight)
+async def process_weight(message: types.Message, state: FSMContext):
     try:
         weight = float(message.text)
         uid = message.from_user.id
-        user_state[uid]['weight'] = weight
-        user_state[uid]['step'] = 'height'
-        logger.info(f"Пользователь {uid} указал вес: {weight} кг")
+        await state.update_data(weight=weight)
+        await state.set_state(ProfileForm.height)
+        logger.info("Пользователь %s указал вес: %s кг", uid, weight)
         await message.answer(f"✅ Вес: {weight} кг\n\nШаг 2 из 5: Введите ваш рост (см):")
     except:
         await message.answer("❌ Введите число (кг)\nПример: 70")
 
-@dp.message(lambda m: m.from_user.id in user_state and user_state[m.from_user.id]['step'] == 'height')
-async def process_height(message: types.Message):
+@dp.message(ProfileForm.height)
+async def process_height(message: types.Message, state: FSMContext):
     try:
         height = float(message.text)
         uid = message.from_user.id
-        user_state[uid]['height'] = height
-        user_state[uid]['step'] = 'age'
-        logger.info(f"Пользователь {uid} указал рост: {height} см")
+        await state.update_data(height=height)
+        await state.set_state(ProfileForm.age)
+        logger.info("Пользователь %s указал рост: %s см", uid, height)
         await message.answer(f"✅ Рост: {height} см\n\nШаг 3 из 5: Введите ваш возраст (лет):")
     except:
         await message.answer("❌ Введите число (см)\nПример: 175")
 
-@dp.message(lambda m: m.from_user.id in user_state and user_state[m.from_user.id]['step'] == 'age')
-async def process_age(message: types.Message):
+@dp.message(ProfileForm.age)
+async def process_age(message: types.Message, state: FSMContext):
     try:
         age = int(message.text)
         uid = message.from_user.id
-        user_state[uid]['age'] = age
-        user_state[uid]['step'] = 'activity'
-        logger.info(f"Пользователь {uid} указал возраст: {age} лет")
+        await state.update_data(age=age)
+        await state.set_state(ProfileForm.activity)
+        logger.info("Пользователь %s указал возраст: %s лет", uid, age)
         await message.answer(
             f"✅ Возраст: {age} лет\n\n"
             f"Шаг 4 из 5: Введите вашу ежедневную активность (мин/день):\n\n"
@@ -192,14 +284,14 @@ async def process_age(message: types.Message):
     except:
         await message.answer("❌ Введите целое число (лет)\nПример: 25")
 
-@dp.message(lambda m: m.from_user.id in user_state and user_state[m.from_user.id]['step'] == 'activity')
-async def process_activity(message: types.Message):
+@dp.message(ProfileForm.activity)
+async def process_activity(message: types.Message, state: FSMContext):
     try:
         activity = int(message.text)
         uid = message.from_user.id
-        user_state[uid]['activity'] = activity
-        user_state[uid]['step'] = 'city'
-        logger.info(f"Пользователь {uid} указал активность: {activity} мин/день")
+        await state.update_data(activity=activity)
+        await state.set_state(ProfileForm.city)
+        logger.info("Пользователь %s указал активность: %s мин/день", uid, activity)
         await message.answer(
             f"✅ Активность: {activity} мин/день\n\n"
             f"Шаг 5 из 5: Введите ваш город:\n\n"
@@ -212,8 +304,8 @@ async def process_activity(message: types.Message):
     except:
         await message.answer("❌ Введите число (минут)\nПример: 60")
 
-@dp.message(lambda m: m.from_user.id in user_state and user_state[m.from_user.id]['step'] == 'city')
-async def process_city(message: types.Message):
+@dp.message(ProfileForm.city)
+async def process_city(message: types.Message, state: FSMContext):
     city = message.text.strip()
     uid = message.from_user.id
     
@@ -222,25 +314,27 @@ async def process_city(message: types.Message):
         return
     
     try:
-        weight = user_state[uid]['weight']
-        height = user_state[uid]['height']
-        age = user_state[uid]['age']
-        activity = user_state[uid]['activity']
+        data = await state.get_data()
+        weight = data['weight']
+        height = data['height']
+        age = data['age']
+        activity = data['activity']
         
-        temp = get_weather(city)
+        temp = await get_weather_async(city)
         water_goal, calorie_goal = calculate_goals(weight, height, age, activity, temp)
         
-        save_user(uid, 
-                 weight=weight, height=height, age=age,
-                 activity=activity, city=city,
-                 water_goal=water_goal, calorie_goal=calorie_goal)
+        await save_user(uid, 
+                       weight=weight, height=height, age=age,
+                       activity=activity, city=city,
+                       water_goal=water_goal, calorie_goal=calorie_goal)
         
-        logger.info(f"Пользователь {uid} создал профиль: "
-                   f"вес={weight}кг, рост={height}см, возраст={age}лет, "
-                   f"активность={activity}мин, город={city}, "
-                   f"вода={water_goal}мл, калории={calorie_goal}ккал")
+        logger.info("Пользователь %s создал профиль: "
+                    "вес=%sкг, рост=%sсм, возраст=%sлет, "
+                    "активность=%sмин, город=%s, "
+                    "вода=%sмл, калории=%sккал",
+                    uid, weight, height, age, activity, city, water_goal, calorie_goal)
         
-        del user_state[uid]
+        await state.clear()
         
         await message.answer(
             f"✅ Профиль создан!\n\n"
@@ -263,300 +357,417 @@ async def process_city(message: types.Message):
         )
         
     except Exception as e:
-        logger.error(f"Ошибка создания профиля для пользователя {uid}: {e}")
+        logger.error("Ошибка создания профиля для пользователя %s: %s", uid, e)
         await message.answer(f"❌ Ошибка: {e}")
-        if uid in user_state:
-            del user_state[uid]
+        await state.clear()
 
-@dp.message()
-async def handle_all_messages(message: types.Message):
-    text = message.text or ""
+@command("/water")
+async def water_cmd(message: types.Message, args, state: FSMContext):
     uid = message.from_user.id
+    if not args:
+        await message.answer("❌ Используйте: /water 500\nПример: /water 300")
+        return
     
-    if uid in user_state:
-        if user_state[uid]['step'] == 'weight':
-            await process_weight(message)
-        elif user_state[uid]['step'] == 'height':
-            await process_height(message)
-        elif user_state[uid]['step'] == 'age':
-            await process_age(message)
-        elif user_state[uid]['step'] == 'activity':
-            await process_activity(message)
-        elif user_state[uid]['step'] == 'city':
-            await process_city(message)
+    try:
+        amount = int(args[0])
+    except ValueError:
+        await message.answer("❌ Введите число после /water\nПример: /water 500")
         return
     
-    if text.startswith('/'):
-        try:
-            parts = text.split()
-            if not parts:
-                await message.answer("❌ Неизвестная команда")
-                return
-                
-            command = parts[0].lower()
-            
-            if command == '/water':
-                if len(parts) >= 2:
-                    try:
-                        amount = int(parts[1])
-                        user = get_user(uid)
-                        
-                        if not user:
-                            await message.answer("❌ Сначала создайте профиль: /setprofile")
-                            return
-                        
-                        if amount <= 0:
-                            await message.answer("❌ Введите положительное число")
-                            return
-                        
-                        add_log(uid, 'water', 'вода', amount)
-                        logger.info(f"Пользователь {uid} записал воду: {amount} мл")
-                        
-                        stats = get_today_stats(uid)
-                        
-                        progress = min(100, int(stats['total_water'] / user['water_goal'] * 100))
-                        bar = '█' * int(progress / 10) + '░' * (10 - int(progress / 10))
-                        
-                        await message.answer(
-                            f"✅ Записано: {amount} мл воды\n"
-                            f"💧 Всего сегодня: {stats['total_water']}/{user['water_goal']} мл\n"
-                            f"{bar} {progress}%"
-                        )
-                    except ValueError:
-                        await message.answer("❌ Введите число после /water\nПример: /water 500")
-                else:
-                    await message.answer("❌ Используйте: /water 500\nПример: /water 300")
-                    
-            elif command == '/food':
-                if len(parts) >= 2:
-                    try:
-                        food_name = parts[1]
-                        grams = 100
-                        
-                        if len(parts) >= 3:
-                            try:
-                                grams = int(parts[2])
-                            except:
-                                pass
-                        
-                        user = get_user(uid)
-                        if not user:
-                            await message.answer("❌ Сначала создайте профиль: /setprofile")
-                            return
-                        
-                        calories_per_100g = get_calories(food_name)
-                        
-                        if calories_per_100g <= 0:
-                            await message.answer(f"❌ Не найден: {food_name}\nПопробуйте: яблоко, банан, курица, пицца, рис, творог")
-                            return
-                        
-                        total_cal = (calories_per_100g * grams) / 100
-                        add_log(uid, 'food', f"{food_name} ({grams}г)", total_cal)
-                        logger.info(f"Пользователь {uid} записал еду: {food_name} {grams}г = {total_cal:.0f} ккал")
-                        
-                        stats = get_today_stats(uid)
-                        
-                        await message.answer(
-                            f"✅ {food_name}\n"
-                            f"🍎 {calories_per_100g} ккал/100г\n"
-                            f"🍽 Порция: {grams}г = {total_cal:.0f} ккал\n"
-                            f"📊 Всего съедено: {stats['total_calories']:.0f} ккал"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка обработки /food для пользователя {uid}: {e}")
-                        await message.answer(f"❌ Ошибка при обработке команды")
-                else:
-                    await message.answer("❌ Используйте: /food яблоко 200\nПример: /food банан 150")
-                    
-            elif command == '/workout':
-                if len(parts) >= 3:
-                    try:
-                        workout_type = parts[1]
-                        minutes = int(parts[2])
-                        user = get_user(uid)
-                        
-                        if not user:
-                            await message.answer("❌ Сначала создайте профиль: /setprofile")
-                            return
-                        
-                        if minutes <= 0:
-                            await message.answer("❌ Введите положительное число")
-                            return
-                        
-                        calories = calculate_burned_calories(workout_type, minutes, user['weight'])
-                        add_log(uid, 'workout', workout_type, calories)
-                        logger.info(f"Пользователь {uid} записал тренировку: {workout_type} {minutes}мин = {calories:.0f} ккал")
-                        
-                        stats = get_today_stats(uid)
-                        
-                        await message.answer(
-                            f"✅ {workout_type}\n"
-                            f"⏱ {minutes} минут\n"
-                            f"🔥 Сожжено: {calories:.0f} ккал\n"
-                            f"📊 Всего сожжено: {stats['total_burned']:.0f} ккал"
-                        )
-                    except ValueError:
-                        await message.answer("❌ Введите число минут\nПример: /workout бег 30")
-                    except Exception as e:
-                        logger.error(f"Ошибка обработки /workout для пользователя {uid}: {e}")
-                        await message.answer(f"❌ Ошибка при обработке команды")
-                else:
-                    await message.answer("❌ Используйте: /workout бег 30\nПример: /workout ходьба 45")
-                    
-            elif command == '/progress':
-                try:
-                    user = get_user(uid)
-                    
-                    if not user:
-                        await message.answer("❌ Сначала создайте профиль: /setprofile")
-                        return
-                    
-                    logger.info(f"Пользователь {uid} запросил прогресс")
-                    stats = get_today_stats(uid)
-                    
-                    water_drank = stats['total_water']
-                    water_goal = user['water_goal']
-                    calories_eaten = stats['total_calories']
-                    calories_burned = stats['total_burned']
-                    calorie_goal = user['calorie_goal']
-                    
-                    water_progress = min(100, int(water_drank / water_goal * 100)) if water_goal > 0 else 0
-                    net_calories = calories_eaten - calories_burned
-                    calorie_progress = min(100, max(0, int(net_calories / calorie_goal * 100))) if calorie_goal > 0 else 0
-                    
-                    water_bar = '█' * int(water_progress / 10) + '░' * (10 - int(water_progress / 10))
-                    calorie_bar = '█' * int(calorie_progress / 10) + '░' * (10 - int(calorie_progress / 10))
-                    
-                    await message.answer(
-                        f"📊 Прогресс за {datetime.now().strftime('%d.%m.%Y')}:\n\n"
-                        f"💧 ВОДА:\n"
-                        f"{water_drank}/{water_goal} мл\n"
-                        f"{water_bar} {water_progress}%\n\n"
-                        f"🔥 КАЛОРИИ:\n"
-                        f"Съедено: {calories_eaten:.0f} ккал\n"
-                        f"Сожжено: {calories_burned:.0f} ккал\n"
-                        f"Баланс: {net_calories:.0f}/{calorie_goal} ккал\n"
-                        f"{calorie_bar} {calorie_progress}%\n\n"
-                        f"📈 Активность:\n"
-                        f"• Приемов пищи: {stats.get('food_count', 0)}\n"
-                        f"• Тренировок: {stats.get('workout_count', 0)}"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка получения прогресса для пользователя {uid}: {e}")
-                    await message.answer(f"❌ Ошибка при получении прогресса")
-                    
-            elif command == '/tips':
-                try:
-                    user = get_user(uid)
-                    
-                    if not user:
-                        await message.answer("❌ Сначала создайте профиль: /setprofile")
-                        return
-                    
-                    logger.info(f"Пользователь {uid} запросил рекомендации")
-                    stats = get_today_stats(uid)
-                    
-                    water_drank = stats['total_water']
-                    water_goal = user['water_goal']
-                    calories_eaten = stats['total_calories']
-                    calories_burned = stats['total_burned']
-                    calorie_goal = user['calorie_goal']
-                    
-                    net_calories = calories_eaten - calories_burned
-                    water_left = water_goal - water_drank
-                    calorie_left = calorie_goal - net_calories
-                    
-                    tips = []
-                    
-                    if water_drank == 0:
-                        tips.append("💧 Вы еще не пили воду сегодня. Начните со стакана воды (200-300 мл)")
-                    elif water_left > 1500:
-                        tips.append(f"💧 Выпейте еще {water_left} мл воды.")
-                    elif water_left > 500:
-                        tips.append(f"💧 Осталось {water_left} мл воды до нормы")
-                    else:
-                        tips.append("💧 Отлично! Вы достигли нормы по воде")
-                    
-                    if net_calories < -500:
-                        tips.append(f"🔥 Дефицит калорий: {-net_calories:.0f} ккал. Можно добавить полезные перекусы")
-                    elif calorie_left > 1000:
-                        tips.append(f"🔥 Можно съесть еще {calorie_left:.0f} ккал до нормы")
-                    elif net_calories > calorie_goal:
-                        tips.append(f"🏃 Перебор на {net_calories - calorie_goal:.0f} ккал. Добавьте активность")
-                    else:
-                        tips.append("🔥 Калории в норме. Продолжайте в том же духе!")
-                    
-                    if stats.get('workout_count', 0) == 0:
-                        tips.append("🚶‍♂️ Сегодня не было тренировок. Попробуйте 15-минутную прогулку")
-                    elif stats.get('workout_count', 0) == 1:
-                        tips.append(f"🏃 Отлично! Сегодня была тренировка: сожжено {calories_burned:.0f} ккал")
-                    else:
-                        tips.append(f"🏃‍♀️ Отличная активность! {stats.get('workout_count', 0)} тренировок сегодня")
-                    
-                    tips.append("🍎 Не забывайте про овощи и фрукты")
-                    tips.append("⏰ Питайтесь регулярно, каждые 3-4 часа")
-                    
-                    await message.answer(
-                        f"💡 Персональные рекомендации на {datetime.now().strftime('%d.%m.%Y')}:\n\n" +
-                        "\n".join(f"• {tip}" for tip in tips)
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка получения рекомендаций для пользователя {uid}: {e}")
-                    await message.answer(f"❌ Ошибка при получении рекомендаций")
-                    
-            elif command in ['/start', '/help', '/profile', '/setprofile', '/reset']:
+    user = await get_user(uid)
+    if not user:
+        await message.answer("❌ Сначала создайте профиль: /setprofile")
+        return
+    
+    if amount <= 0:
+        await message.answer("❌ Введите положительное число")
+        return
+    
+    await add_log(uid, 'water', None, amount)
+    logger.info("Пользователь %s записал воду: %s мл", uid, amount)
+    
+    stats = await get_today_stats(uid)
+    
+    progress = min(100, int(stats['total_water'] / user['water_goal'] * 100))
+    bar = '█' * int(progress / 10) + '░' * (10 - int(progress / 10))
+    
+    await message.answer(
+        f"✅ Записано: {amount} мл воды\n"
+        f"💧 Всего сегодня: {stats['total_water']}/{user['water_goal']} мл\n"
+        f"{bar} {progress}%"
+    )
+
+@command("/food")
+async def food_cmd(message: types.Message, args, state: FSMContext):
+    uid = message.from_user.id
+    if not args:
+        await message.answer("❌ Используйте: /food яблоко 200\nПример: /food банан 150")
+        return
+    
+    try:
+        food_name = args[0]
+        grams = 100
+        
+        if len(args) >= 2:
+            try:
+                grams = int(args[1])
+            except:
                 pass
-            else:
-                await message.answer(
-                    "❌ Неизвестная команда\n\n"
-                    "📋 Правильные команды:\n"
-                    "/water 500 - записать воду\n"
-                    "/food яблоко 200 - записать еду\n"
-                    "/workout бег 30 - записать тренировку\n"
-                    "/start - все команды"
-                )
-        except Exception as e:
-            logger.error(f"Общая ошибка обработки команды от пользователя {uid}: {e}")
-            await message.answer("❌ Произошла ошибка при обработке команды")
-    else:
-        await message.answer("Используйте /start для списка команд")
+        
+        user = await get_user(uid)
+        if not user:
+            await message.answer("❌ Сначала создайте профиль: /setprofile")
+            return
+        
+        calories_per_100g = await get_calories_async(food_name)
+        
+        if calories_per_100g <= 0:
+            await message.answer(f"❌ Не найден: {food_name}\nПопробуйте: яблоко, банан, курица, пицца, рис, творог")
+            return
+        
+        total_cal = (calories_per_100g * grams) / 100
+        await add_log(uid, 'food', food_name, total_cal, grams)
+        logger.info("Пользователь %s записал еду: %s %sг = %.0f ккал", uid, food_name, grams, total_cal)
+        
+        stats = await get_today_stats(uid)
+        
+        macros = ""
+        # Продукт уже найден при подсчёте калорий и берётся из контекста апдейта.
+        # БЖУ показываем, только если калории взяты из офлайн-базы
+        _, product = await find_local_food(food_name)
+        if product and None not in (product['protein'], product['fat'], product['carbs']):
+            macros = (f"🥩 Б/Ж/У: {product['protein'] * grams / 100:.1f}/"
+                      f"{product['fat'] * grams / 100:.1f}/"
+                      f"{product['carbs'] * grams / 100:.1f} г\n")
+        
+        await message.answer(
+            f"✅ {food_name}\n"
+            f"🍎 {calories_per_100g} ккал/100г\n"
+            f"🍽 Порция: {grams}г = {total_cal:.0f} ккал\n"
+            f"{macros}"
+            f"📊 Всего съедено: {stats['total_calories']:.0f} ккал"
+        )
+    except Exception as e:
+        logger.error("Ошибка обработки /food для пользователя %s: %s", uid, e)
+        await message.answer(f"❌ Ошибка при обработке команды")
+
+@command("/workout")
+async def workout_cmd(message: types.Message, args, state: FSMContext):
+    uid = message.from_user.id
+    if len(args) < 2:
+        await message.answer("❌ Используйте: /workout бег 30\nПример: /workout ходьба 45")
+        return
+    
+    try:
+        workout_type = args[0]
+        minutes = int(args[1])
+        user = await get_user(uid)
+        
+        if not user:
+            await message.answer("❌ Сначала создайте профиль: /setprofile")
+            return
+        
+        if minutes <= 0:
+            await message.answer("❌ Введите положительное число")
+            return
+        
+        calories = calculate_burned_calories(workout_type, minutes, user['weight'])
+        await add_log(uid, 'workout', workout_type, calories, minutes)
+        logger.info("Пользователь %s записал тренировку: %s %sмин = %.0f ккал", uid, workout_type, minutes, calories)
+        
+        stats = await get_today_stats(uid)
+        
+        await message.answer(
+            f"✅ {workout_type}\n"
+            f"⏱ {minutes} минут\n"
+            f"🔥 Сожжено: {calories:.0f} ккал\n"
+            f"📊 Всего сожжено: {stats['total_burned']:.0f} ккал"
+        )
+    except ValueError:
+        await message.answer("❌ Введите число минут\nПример: /workout бег 30")
+    except Exception as e:
+        logger.error("Ошибка обработки /workout для пользователя %s: %s", uid, e)
+        await message.answer(f"❌ Ошибка при обработке команды")
+
+@command("/progress")
+async def progress_cmd(message: types.Message, args, state: FSMContext):
+    uid = message.from_user.id
+    try:
+        user = await get_user(uid)
+        
+        if not user:
+            await message.answer("❌ Сначала создайте профиль: /setprofile")
+            return
+        
+        logger.debug("Пользователь %s запросил прогресс", uid)
+        stats = await get_today_stats(uid)
+        
+        water_drank = stats['total_water']
+        water_goal = user['water_goal']
+        calories_eaten = stats['total_calories']
+        calories_burned = stats['total_burned']
+        calorie_goal = user['calorie_goal']
+        
+        water_progress = min(100, int(water_drank / water_goal * 100)) if water_goal > 0 else 0
+        net_calories = calories_eaten - calories_burned
+        calorie_progress = min(100, max(0, int(net_calories / calorie_goal * 100))) if calorie_goal > 0 else 0
+        
+        water_bar = '█' * int(water_progress / 10) + '░' * (10 - int(water_progress / 10))
+        calorie_bar = '█' * int(calorie_progress / 10) + '░' * (10 - int(calorie_progress / 10))
+        
+        await message.answer(
+            f"📊 Прогресс за {date.fromisoformat(stats['day']).strftime('%d.%m.%Y')}:\n\n"
+            f"💧 ВОДА:\n"
+            f"{water_drank}/{water_goal} мл\n"
+            f"{water_bar} {water_progress}%\n\n"
+            f"🔥 КАЛОРИИ:\n"
+            f"Съедено: {calories_eaten:.0f} ккал\n"
+            f"Сожжено: {calories_burned:.0f} ккал\n"
+            f"Баланс: {net_calories:.0f}/{calorie_goal} ккал\n"
+            f"{calorie_bar} {calorie_progress}%\n\n"
+            f"📈 Активность:\n"
+            f"• Приемов пищи: {stats.get('food_count', 0)}\n"
+            f"• Тренировок: {stats.get('workout_count', 0)}"
+        )
+    except Exception as e:
+        logger.error("Ошибка получения прогресса для пользователя %s: %s", uid, e)
+        await message.answer(f"❌ Ошибка при получении прогресса")
+
+# Самый длинный период для /history
+HISTORY_MAX_DAYS = 365
+
+async def send_history(message: types.Message, days):
+    uid = message.from_user.id
+    try:
+        user = await get_user(uid)
+        
+        if not user:
+            await message.answer("❌ Сначала создайте профиль: /setprofile")
+            return
+        
+        logger.debug("Пользователь %s запросил историю за %s дн.", uid, days)
+        summaries = await get_daily_summaries(uid, days)
+        
+        if not summaries:
+            await message.answer(f"📅 За последние {days} дн. записей нет")
+            return
+        
+        water_goal = user['water_goal'] or 0
+        lines = [f"📅 История за {days} дн.:\n"]
+        for day in summaries:
+            lines.append(
+                f"{date.fromisoformat(day['day']).strftime('%d.%m')}: "
+                f"💧 {day['water_total']} мл · 🍎 {day['food_total']:.0f} ккал · 🏃 {day['workout_total']:.0f} ккал"
+            )
+        
+        active_days = len(summaries)
+        water_total = sum(day['water_total'] for day in summaries)
+        food_total = sum(day['food_total'] for day in summaries)
+        workout_total = sum(day['workout_total'] for day in summaries)
+        water_days = sum(1 for day in summaries if water_goal > 0 and day['water_total'] >= water_goal)
+        
+        lines.append(
+            f"\n📊 Итого за {active_days} дн. с записями:\n"
+            f"💧 Вода: {water_total:.0f} мл (в среднем {water_total / active_days:.0f} мл в день)\n"
+            f"🔥 Съедено: {food_total:.0f} ккал, сожжено: {workout_total:.0f} ккал\n"
+            f"⚖️ Средний баланс: {(food_total - workout_total) / active_days:.0f} ккал в день\n"
+            f"🍽 Приемов пищи: {sum(day['food_count'] for day in summaries)}, "
+            f"тренировок: {sum(day['workout_count'] for day in summaries)}\n"
+            f"✅ Норма воды выполнена: {water_days} из {active_days} дн."
+        )
+        await message.answer("\n".join(lines))
+    except Exception as e:
+        logger.error("Ошибка получения истории для пользователя %s: %s", uid, e)
+        await message.answer(f"❌ Ошибка при получении истории")
+
+@command("/history")
+async def history_cmd(message: types.Message, args, state: FSMContext):
+    days = 7
+    if args:
+        try:
+            days = int(args[0])
+            if not 1 <= days <= HISTORY_MAX_DAYS:
+                raise ValueError
+        except ValueError:
+            await message.answer(f"❌ Укажите число дней от 1 до {HISTORY_MAX_DAYS}: /history 14")
+            return
+    await send_history(message, days)
+
+@command("/week")
+async def week_cmd(message: types.Message, args, state: FSMContext):
+    await send_history(message, 7)
+
+@command("/month")
+async def month_cmd(message: types.Message, args, state: FSMContext):
+    await send_history(message, 30)
+
+@command("/tips")
+async def tips_cmd(message: types.Message, args, state: FSMContext):
+    uid = message.from_user.id
+    try:
+        user = await get_user(uid)
+        
+        if not user:
+            await message.answer("❌ Сначала создайте профиль: /setprofile")
+            return
+        
+        logger.debug("Пользователь %s запросил рекомендации", uid)
+        stats = await get_today_stats(uid)
+        
+        water_drank = stats['total_water']
+        water_goal = user['water_goal']
+        calories_eaten = stats['total_calories']
+        calories_burned = stats['total_burned']
+        calorie_goal = user['calorie_goal']
+        
+        net_calories = calories_eaten - calories_burned
+        water_left = water_goal - water_drank
+        calorie_left = calorie_goal - net_calories
+        
+        tips = []
+        
+        if water_drank == 0:
+            tips.append("💧 Вы еще не пили воду сегодня. Начните со стакана воды (200-300 мл)")
+        elif water_left > 1500:
+            tips.append(f"💧 Выпейте еще {water_left} мл воды.")
+        elif water_left > 500:
+            tips.append(f"💧 Осталось {water_left} мл воды до нормы")
+        else:
+            tips.append("💧 Отлично! Вы достигли нормы по воде")
+        
+        if net_calories < -500:
+            tips.append(f"🔥 Дефицит калорий: {-net_calories:.0f} ккал. Можно добавить полезные перекусы")
+        elif calorie_left > 1000:
+            tips.append(f"🔥 Можно съесть еще {calorie_left:.0f} ккал до нормы")
+        elif net_calories > calorie_goal:
+            tips.append(f"🏃 Перебор на {net_calories - calorie_goal:.0f} ккал. Добавьте активность")
+        else:
+            tips.append("🔥 Калории в норме. Продолжайте в том же духе!")
+        
+        if stats.get('workout_count', 0) == 0:
+            tips.append("🚶‍♂️ Сегодня не было тренировок. Попробуйте 15-минутную прогулку")
+        elif stats.get('workout_count', 0) == 1:
+            tips.append(f"🏃 Отлично! Сегодня была тренировка: сожжено {calories_burned:.0f} ккал")
+        else:
+            tips.append(f"🏃‍♀️ Отличная активность! {stats.get('workout_count', 0)} тренировок сегодня")
+        
+        tips.append("🍎 Не забывайте про овощи и фрукты")
+        tips.append("⏰ Питайтесь регулярно, каждые 3-4 часа")
+        
+        await message.answer(
+            f"💡 Персональные рекомендации на {date.fromisoformat(stats['day']).strftime('%d.%m.%Y')}:\n\n" +
+            "\n".join(f"• {tip}" for tip in tips)
+        )
+    except Exception as e:
+        logger.error("Ошибка получения рекомендаций для пользователя %s: %s", uid, e)
+        await message.answer(f"❌ Ошибка при получении рекомендаций")
+
+@dp.message()
+async def handle_all_messages(message: types.Message):
+    await message.answer("Используйте /start для списка команд")
 
 async def on_startup():
+    global metrics_runner, retention_task
     try:
         logger.info("=" * 50)
         logger.info("🤖 ЗАПУСК БОТА ДЛЯ КОНТРОЛЯ ЗДОРОВЬЯ")
         logger.info("=" * 50)
         
-        init_db()
+        await init_db()
         logger.info("📊 База данных инициализирована")
         
+        await init_http()
+        logger.info("🍎 Кэш продуктов загружен: %s записей", await warm_food_cache())
+        
+        if METRICS_PORT:
+            metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT, refresh_metrics)
+            logger.info("📈 Метрики: http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+        
+        retention_task = start_retention()
+        
         logger.info("🚀 Бот запущен и ожидает сообщений...")
-        logger.info(f"Имя бота: @{(await bot.me()).username}")
+        logger.info("Имя бота: @%s", (await bot.me()).username)
         logger.info("=" * 50)
         
     except Exception as e:
-        logger.error(f"Ошибка при старте бота: {e}")
+        logger.error("Ошибка при старте бота: %s", e)
         raise
 
+def create_webhook_app(secret_token):
+    app = web.Application()
+    # Апдейт обрабатывается внутри HTTP-запроса: Telegram получает ответ только
+    # после обработки, а runner.cleanup() дожидается всех начатых запросов
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=False
+    ).register(app, path=WEBHOOK_PATH)
+    return app
+
+async def run_webhook():
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужен WEBHOOK_URL")
+    
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    runner = web.AppRunner(create_webhook_app(secret_token), shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info("🌐 Вебхук слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await stop.wait()
+    finally:
+        logger.info("⏳ Ожидание завершения обработки апдейтов...")
+        await runner.cleanup()
+
 async def main():
     try:
         await on_startup()
         
-        await dp.start_polling(bot, skip_updates=True)
+        if BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot, skip_updates=True)
         
     except Exception as e:
-        logger.critical(f"❌ КРИТИЧЕСКАЯ ОШИБКА ПРИ ЗАПУСКЕ БОТА: {e}")
+        logger.critical("❌ КРИТИЧЕСКАЯ ОШИБКА ПРИ ЗАПУСКЕ БОТА: %s", e)
         raise
     finally:
         logger.info("🛑 Бот остановлен")
+        if retention_task is not None:
+            retention_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_db()
+        await close_http()
         await bot.session.close()
 
 if __name__ == "__main__":
+    # Воркеры наследуют QueueHandler после fork, поэтому им нужна межпроцессная очередь
+    log_listener = setup_logging(multiprocessing.Queue() if BOT_WORKERS > 1 else None)
     try:
-        asyncio.run(main())
+        if BOT_WORKERS > 1:
+            from workers import run_workers
+            run_workers(bot, dp, BOT_WORKERS, BOT_MODE)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("🛑 Бот остановлен пользователем (Ctrl+C)")
     except Exception as e:
-        logger.critical(f"❌ НЕОБРАБОТАННАЯ ОШИБКА: {e}")
+        logger.critical("❌ НЕОБРАБОТАННАЯ ОШИБКА: %s", e)
+    finally:
+        log_listener.stop()
 
 
@@ -35,3 +35,109 @@ FOOD_DB = {
     "кофе": 1, "чай": 1, "сок": 45, "кола": 42,
 
     "пиво": 43, "вино": 83, "водка": 235}
+
+
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'Europe/Moscow')
+
+# Офлайн-база продуктов (python food_store.py import <дамп>); если файла нет - только FOOD_DB
+FOOD_STORE_PATH = os.getenv('FOOD_STORE_PATH', 'foods.db')
+
+# polling - для разработки, webhook - для продакшена (нужен WEBHOOK_URL)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+# Сколько секунд при остановке ждать завершения уже принятых апдейтов
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', 30))
+
+# BOT_WORKERS > 1 - апдейты распределяются между процессами-воркерами по user_id
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))
+# Сколько апдейтов разных пользователей воркер обрабатывает одновременно
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 32))
+
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# text или json (одна JSON-запись на строку)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Ротация по размеру, либо по времени, если задан LOG_ROTATE_WHEN (midnight, H, D...)
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+# Доля сохраняемых INFO-записей о каждом входящем апдейте (0..1)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+
+# Эндпоинт /metrics в формате Prometheus (0 - выключен).
+# Воркеры слушают METRICS_PORT + 1 + номер воркера
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+# Лимиты входящих апдейтов (токенов в секунду и размер пачки)
+RATE_LIMIT_USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE', 1))
+RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', 10))
+RATE_LIMIT_GLOBAL_RATE = float(os.getenv('RATE_LIMIT_GLOBAL_RATE', 100))
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv('RATE_LIMIT_GLOBAL_BURST', 200))
+# Дорогие команды: /food с запросом к OpenFoodFacts и /profile с погодой
+RATE_LIMIT_FOOD_LOOKUP_RATE = float(os.getenv('RATE_LIMIT_FOOD_LOOKUP_RATE', 0.1))
+RATE_LIMIT_FOOD_LOOKUP_BURST = int(os.getenv('RATE_LIMIT_FOOD_LOOKUP_BURST', 3))
+RATE_LIMIT_PROFILE_RATE = float(os.getenv('RATE_LIMIT_PROFILE_RATE', 0.2))
+RATE_LIMIT_PROFILE_BURST = int(os.getenv('RATE_LIMIT_PROFILE_BURST', 3))
+# Исходящие сообщения: лимиты Telegram около 30/с на бота и 1/с на чат
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+# Сколько пользователей/чатов помнит каждый лимитер (самые давние вытесняются)
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 10000))
+
+# Сырые логи старше RETENTION_DAYS дней удаляются (0 - хранить всегда), итоги по дням
+# остаются в daily_summary. Если задан RETENTION_ARCHIVE_DIR, удаляемые записи сначала
+# дописываются туда в logs-ГГГГ-ММ.jsonl.gz
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 180))
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', 'archive')
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 24 * 3600))
+# Строк на одну транзакцию удаления: запись новых логов ждёт не дольше одной пачки
+RETENTION_BATCH = int(os.getenv('RETENTION_BATCH', 1000))
+
+CITY_TIMEZONES = {
+    "калининград": "Europe/Kaliningrad",
+    
+    "москва": "Europe/Moscow", "санкт-петербург": "Europe/Moscow", "питер": "Europe/Moscow",
+    "спб": "Europe/Moscow", "казань": "Europe/Moscow", "нижний новгород": "Europe/Moscow",
+    "ростов-на-дону": "Europe/Moscow", "краснодар": "Europe/Moscow", "воронеж": "Europe/Moscow",
+    "ярославль": "Europe/Moscow", "тула": "Europe/Moscow", "рязань": "Europe/Moscow",
+    "тверь": "Europe/Moscow", "калуга": "Europe/Moscow", "владимир": "Europe/Moscow",
+    "белгород": "Europe/Moscow", "курск": "Europe/Moscow", "липецк": "Europe/Moscow",
+    "брянск": "Europe/Moscow", "смоленск": "Europe/Moscow", "мурманск": "Europe/Moscow",
+    "архангельск": "Europe/Moscow", "петрозаводск": "Europe/Moscow", "сочи": "Europe/Moscow",
+    "ставрополь": "Europe/Moscow", "махачкала": "Europe/Moscow", "пенза": "Europe/Moscow",
+    "киров": "Europe/Moscow", "чебоксары": "Europe/Moscow", "симферополь": "Europe/Simferopol",
+    "волгоград": "Europe/Volgograd",
+    
+    "самара": "Europe/Samara", "тольятти": "Europe/Samara", "ижевск": "Europe/Samara",
+    "саратов": "Europe/Saratov", "ульяновск": "Europe/Ulyanovsk", "астрахань": "Europe/Astrakhan",
+    
+    "екатеринбург": "Asia/Yekaterinburg", "челябинск": "Asia/Yekaterinburg", "уфа": "Asia/Yekaterinburg",
+    "пермь": "Asia/Yekaterinburg", "тюмень": "Asia/Yekaterinburg", "оренбург": "Asia/Yekaterinburg",
+    "сургут": "Asia/Yekaterinburg", "курган": "Asia/Yekaterinburg", "магнитогорск": "Asia/Yekaterinburg",
+    
+    "омск": "Asia/Omsk",
+    
+    "новосибирск": "Asia/Novosibirsk", "томск": "Asia/Tomsk", "барнаул": "Asia/Barnaul",
+    "кемерово": "Asia/Novokuznetsk", "новокузнецк": "Asia/Novokuznetsk",
+    "красноярск": "Asia/Krasnoyarsk", "абакан": "Asia/Krasnoyarsk", "норильск": "Asia/Krasnoyarsk",
+    
+    "иркутск": "Asia/Irkutsk", "улан-удэ": "Asia/Irkutsk", "братск": "Asia/Irkutsk",
+    
+    "якутск": "Asia/Yakutsk", "чита": "Asia/Chita", "благовещенск": "Asia/Yakutsk",
+    
+    "владивосток": "Asia/Vladivostok", "хабаровск": "Asia/Vladivostok",
+    "комсомольск-на-амуре": "Asia/Vladivostok", "находка": "Asia/Vladivostok",
+    
+    "магадан": "Asia/Magadan", "южно-сахалинск": "Asia/Sakhalin",
+    
+    "петропавловск-камчатский": "Asia/Kamchatka", "анадырь": "Asia/Anadyr",
+    
+    "минск": "Europe/Minsk", "киев": "Europe/Kyiv", "астана": "Asia/Almaty",
+    "алматы": "Asia/Almaty", "ташкент": "Asia/Tashkent", "бишкек": "Asia/Bishkek",
+    "тбилиси": "Asia/Tbilisi", "ереван": "Asia/Yerevan", "баку": "Asia/Baku"}
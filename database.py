@@ -1,290 +1,1011 @@
 ﻿import sqlite3
-from datetime import datetime, date
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from config import DEFAULT_TIMEZONE, RETENTION_DAYS, RETENTION_ARCHIVE_DIR, RETENTION_BATCH
+from timezones import local_day, sqlite_offset, timezone_for_city
 
 DB_NAME = "health.db"
+POOL_SIZE = 4
+POOL_TIMEOUT = 10
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+# Отложенная запись логов: записи копятся в памяти и сбрасываются одной
+# транзакцией раз в DB_BATCH_INTERVAL_MS мс или по DB_BATCH_SIZE записей.
+# При аварийном завершении процесса несброшенные записи теряются.
+BATCH_WRITES = os.getenv('DB_BATCH_WRITES', '0') == '1'
+BATCH_INTERVAL_MS = int(os.getenv('DB_BATCH_INTERVAL_MS', 200))
+BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 100))
+
+# Дневные итоги активных пользователей для get_today_stats
+DAILY_CACHE_SIZE = int(os.getenv('DB_DAILY_CACHE_SIZE', 10000))
+
+# Сколько свободных страниц возвращать ОС за одну транзакцию incremental_vacuum
+VACUUM_PAGES = int(os.getenv('DB_VACUUM_PAGES', 2000))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# _pending_lock защищает и очередь отложенных записей, и кэш дневных итогов:
+# запись в очередь и обновление итогов должны происходить атомарно
+_pending_logs = []
+_pending_lock = threading.Lock()
+_daily_cache = OrderedDict()
+daily_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_timezone_cache = OrderedDict()
+_log_names = OrderedDict()
+_flush_lock = threading.Lock()
+_flush_wakeup = threading.Event()
+_flush_stop = threading.Event()
+_flush_thread = None
+_maintenance_stop = threading.Event()
+
+def _connect():
+    conn = sqlite3.connect(DB_NAME, timeout=POOL_TIMEOUT, check_same_thread=False, cached_statements=128)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def _open_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            pool = queue.Queue(maxsize=POOL_SIZE)
+            for _ in range(POOL_SIZE):
+                pool.put(_connect())
+            _pool = pool
+    return _pool
+
+@contextmanager
+def _connection():
+    pool = _pool or _open_pool()
+    conn = pool.get(timeout=POOL_TIMEOUT)
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.put(conn)
+
+def close_db():
+    global _pool
+    _stop_flusher()
+    flush_logs()
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    while not pool.empty():
+        pool.get_nowait().close()
+
+# Тип записи хранится числом, названия еды и тренировок - в словаре log_names
+LOG_TYPES = {'water': 1, 'food': 2, 'workout': 3}
+LOG_TYPE_NAMES = {number: name for name, number in LOG_TYPES.items()}
+
+def _day_number(day):
+    # Локальный день в logs - целое ГГГГММДД: 4 байта вместо 10 и тот же порядок
+    return int(day.replace('-', ''))
+
+def _day_text(number):
+    return f'{number // 10000:04d}-{number // 100 % 100:02d}-{number % 100:02d}'
+
+def _log_value(log_type, name, quantity):
+    # Текст записи в прежнем виде: "вода", "яблоко (200г)", "бег"
+    if log_type == 'water':
+        return 'вода'
+    if log_type == 'food' and quantity is not None:
+        return f'{name} ({quantity:g}г)'
+    return name
+
+def _backfill_days(cursor):
+    for user_id, city in cursor.execute('SELECT user_id, city FROM users').fetchall():
+        cursor.execute('UPDATE users SET timezone = ? WHERE user_id = ?', (timezone_for_city(city), user_id))
     
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        weight REAL, 
-        height REAL, 
-        age INTEGER,
-        activity INTEGER, 
-        city TEXT,
-        water_goal INTEGER, 
-        calorie_goal INTEGER,
-        water_drank INTEGER DEFAULT 0,
-        calories_eaten REAL DEFAULT 0,
-        calories_burned REAL DEFAULT 0,
-        last_reset_date DATE)
-    ''')
+    # Смещение пояса берётся на текущий момент: в поясах России нет перехода
+    # на летнее время
+    for (timezone_name,) in cursor.execute('SELECT DISTINCT timezone FROM users').fetchall():
+        cursor.execute('''
+        UPDATE logs SET day = DATE(created_at, ?)
+        WHERE user_id IN (SELECT user_id FROM users WHERE timezone = ?)
+        ''', (sqlite_offset(timezone_name), timezone_name))
+    cursor.execute('UPDATE logs SET day = DATE(created_at, ?) WHERE day IS NULL', (sqlite_offset(DEFAULT_TIMEZONE),))
+
+def _enable_incremental_vacuum(cursor):
+    # auto_vacuum меняется только пересборкой файла, а VACUUM нельзя выполнить
+    # внутри транзакции, поэтому _migrate выполняет её вне BEGIN. Повторный
+    # запуск после сбоя безопасен. На большой базе миграция занимает время один раз
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    cursor.execute('VACUUM')
+
+_FOOD_VALUE = re.compile(r'^(.*) \((\d+(?:\.\d+)?)г\)$')
+
+def _compact_logs(cursor):
+    # Старые текстовые value разбираются один раз на каждое уникальное значение:
+    # "яблоко (200г)" -> название в log_names и 200 в quantity
+    cursor.execute('CREATE TEMP TABLE log_values (type TEXT, value TEXT, name_id INTEGER, quantity REAL, PRIMARY KEY (type, value))')
+    for log_type, value in cursor.execute("SELECT DISTINCT type, value FROM logs WHERE type IN ('food', 'workout')").fetchall():
+        name, quantity = value or '', None
+        match = _FOOD_VALUE.match(name) if log_type == 'food' else None
+        if match:
+            name, quantity = match.group(1), float(match.group(2))
+        name = name.strip().lower()
+        cursor.execute('INSERT OR IGNORE INTO log_names (name) VALUES (?)', (name,))
+        name_id = cursor.execute('SELECT id FROM log_names WHERE name = ?', (name,)).fetchone()[0]
+        cursor.execute('INSERT INTO log_values VALUES (?, ?, ?, ?)', (log_type, value, name_id, quantity))
     
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        type TEXT,  -- 'water', 'food', 'workout'
-        value TEXT,
-        amount REAL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-    )
+    cursor.execute('''
+    INSERT INTO logs_compact (id, user_id, type, name_id, quantity, amount, created_at, day)
+    SELECT l.id, l.user_id,
+        CASE l.type WHEN 'water' THEN 1 WHEN 'food' THEN 2 ELSE 3 END,
+        v.name_id, v.quantity, l.amount,
+        CAST(strftime('%s', l.created_at) AS INTEGER),
+        CAST(REPLACE(l.day, '-', '') AS INTEGER)
+    FROM logs l
+    LEFT JOIN log_values v ON v.type = l.type AND v.value = l.value
+    WHERE l.type IN ('water', 'food', 'workout')
     ''')
-    
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_id ON logs(user_id)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs(created_at)')
-    
+    cursor.execute('DROP TABLE log_values')
+
+# Миграции схемы по номеру PRAGMA user_version. Каждый элемент - список
+# SQL-выражений (или функций от курсора), которые применяются к базам
+# с меньшей версией.
+_MIGRATIONS = [
+    # 1: выборки логов пользователя за период идут по составному индексу
+    [
+        'CREATE INDEX IF NOT EXISTS idx_logs_user_created ON logs(user_id, created_at)',
+        'DROP INDEX IF EXISTS idx_logs_user_id',
+    ],
+    # 2: часовой пояс пользователя и локальный день каждой записи
+    [
+        'ALTER TABLE users ADD COLUMN timezone TEXT',
+        'ALTER TABLE logs ADD COLUMN day TEXT',
+        _backfill_days,
+        'CREATE INDEX IF NOT EXISTS idx_logs_user_day ON logs(user_id, day)',
+        'DROP INDEX IF EXISTS idx_logs_user_created',
+    ],
+    # 3: дневные итоги пользователя для отчётов за неделю и месяц
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            water REAL NOT NULL DEFAULT 0,
+            food_kcal REAL NOT NULL DEFAULT 0,
+            burned_kcal REAL NOT NULL DEFAULT 0,
+            food_count INTEGER NOT NULL DEFAULT 0,
+            workout_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR REPLACE INTO daily_summary
+        SELECT user_id, day,
+            COALESCE(SUM(CASE WHEN type = 'water' THEN amount END), 0),
+            COALESCE(SUM(CASE WHEN type = 'food' THEN amount END), 0),
+            COALESCE(SUM(CASE WHEN type = 'workout' THEN amount END), 0),
+            COUNT(CASE WHEN type = 'food' THEN 1 END),
+            COUNT(CASE WHEN type = 'workout' THEN 1 END)
+        FROM logs
+        WHERE day IS NOT NULL
+        GROUP BY user_id, day
+        ''',
+    ],
+    # 4: место от удалённых логов возвращается ОС через PRAGMA incremental_vacuum
+    [
+        _enable_incremental_vacuum,
+    ],
+    # 5: компактные логи - тип числом, название ссылкой на словарь, граммы и
+    # минуты в quantity, время и день целыми числами
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS log_names (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE logs_compact (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            type INTEGER NOT NULL,  -- LOG_TYPES: 1 вода, 2 еда, 3 тренировка
+            name_id INTEGER,  -- log_names.id, у воды NULL
+            quantity REAL,  -- граммы еды или минуты тренировки
+            amount REAL NOT NULL,  -- мл воды или ккал
+            created_at INTEGER NOT NULL,  -- unix-время UTC
+            day INTEGER NOT NULL,  -- локальный день пользователя, ГГГГММДД
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+        ''',
+        _compact_logs,
+        'DROP TABLE logs',
+        'ALTER TABLE logs_compact RENAME TO logs',
+        'CREATE INDEX idx_logs_user_day ON logs(user_id, day)',
+        'CREATE INDEX idx_logs_created_at ON logs(created_at)',
+    ],
+]
+
+# Шаги, которые SQLite не выполняет внутри транзакции
+_NON_TRANSACTIONAL = {_enable_incremental_vacuum}
+
+def _migrate(cursor):
+    # Каждая миграция вместе с новым user_version - одна явная транзакция:
+    # прерванная миграция откатывается целиком и при следующем запуске
+    # выполняется заново. В режиме по умолчанию модуль sqlite3 выполнял бы
+    # CREATE/ALTER вне транзакции, и они оставались бы в базе после сбоя
+    conn = cursor.connection
     conn.commit()
-    conn.close()
-    print(f"База данных {DB_NAME} инициализирована")
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    try:
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(_MIGRATIONS[version:], version + 1):
+            atomic = not any(statement in _NON_TRANSACTIONAL for statement in statements)
+            if atomic:
+                cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for statement in statements:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {number}')
+                if atomic:
+                    cursor.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                raise
+    finally:
+        conn.isolation_level = isolation_level
 
-def save_user(user_id, **data):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
-    
-    if cur.fetchone():
+def init_db():
+    _maintenance_stop.clear()
+    _open_pool()
+    if BATCH_WRITES:
+        _start_flusher()
+    with _connection() as conn:
+        cur = conn.cursor()
+        
         cur.execute('''
-        UPDATE users SET 
-            weight = ?, height = ?, age = ?, activity = ?, city = ?,
-            water_goal = ?, calorie_goal = ?
-        WHERE user_id = ?
-        ''', (
-            data.get('weight'), data.get('height'), data.get('age'),
-            data.get('activity'), data.get('city'),
-            data.get('water_goal'), data.get('calorie_goal'), 
-            user_id
-        ))
-    else:
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            weight REAL, 
+            height REAL, 
+            age INTEGER,
+            activity INTEGER, 
+            city TEXT,
+            water_goal INTEGER, 
+            calorie_goal INTEGER,
+            water_drank INTEGER DEFAULT 0,
+            calories_eaten REAL DEFAULT 0,
+            calories_burned REAL DEFAULT 0,
+            last_reset_date DATE)
+        ''')
+        
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            type TEXT,  -- 'water', 'food', 'workout'
+            value TEXT,
+            amount REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+        ''')
+        
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs(created_at)')
+        
         cur.execute('''
-        INSERT INTO users 
-        (user_id, weight, height, age, activity, city, 
-         water_goal, calorie_goal, last_reset_date)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id, data.get('weight'), data.get('height'), data.get('age'),
-            data.get('activity'), data.get('city'),
-            data.get('water_goal'), data.get('calorie_goal'),
-            date.today().isoformat()
-        ))
+        CREATE TABLE IF NOT EXISTS food_cache (
+            query TEXT PRIMARY KEY,
+            calories REAL,  -- NULL: продукт не найден
+            updated_at REAL
+        )
+        ''')
+        
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL
+        )
+        ''')
+        
+        _migrate(cur)
+        
+        conn.commit()
+    print(f"База данных {DB_NAME} инициализирована")
+
+def save_user(user_id, **data):
+    timezone_name = data.get('timezone') or timezone_for_city(data.get('city'))
     
-    conn.commit()
-    conn.close()
+    with _flush_lock, _connection() as conn:
+        _invalidate_daily_cache(user_id)
+        cur = conn.cursor()
+        
+        cur.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+        
+        if cur.fetchone():
+            cur.execute('''
+            UPDATE users SET 
+                weight = ?, height = ?, age = ?, activity = ?, city = ?,
+                water_goal = ?, calorie_goal = ?, timezone = ?
+            WHERE user_id = ?
+            ''', (
+                data.get('weight'), data.get('height'), data.get('age'),
+                data.get('activity'), data.get('city'),
+                data.get('water_goal'), data.get('calorie_goal'), 
+                timezone_name, user_id
+            ))
+        else:
+            cur.execute('''
+            INSERT INTO users 
+            (user_id, weight, height, age, activity, city, 
+             water_goal, calorie_goal, timezone)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id, data.get('weight'), data.get('height'), data.get('age'),
+                data.get('activity'), data.get('city'),
+                data.get('water_goal'), data.get('calorie_goal'),
+                timezone_name
+            ))
+        
+        conn.commit()
+    _remember_timezone(user_id, timezone_name)
 
 def get_user(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    with _connection() as conn:
+        return _get_user(conn.cursor(), user_id)
+
+def _get_user(cursor, user_id):
+    cursor.execute('''
+    SELECT user_id, weight, height, age, activity, city, water_goal, calorie_goal, timezone
+    FROM users WHERE user_id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
     
     if row:
-        try:
-            return {
-                'user_id': row[0],
-                'weight': row[1] if len(row) > 1 else 0,
-                'height': row[2] if len(row) > 2 else 0,
-                'age': row[3] if len(row) > 3 else 0,
-                'activity': row[4] if len(row) > 4 else 0,
-                'city': row[5] if len(row) > 5 else '',
-                'water_goal': row[6] if len(row) > 6 else 0,
-                'calorie_goal': row[7] if len(row) > 7 else 0,
-                'water_drank': row[8] if len(row) > 8 else 0,
-                'calories_eaten': row[9] if len(row) > 9 else 0,
-                'calories_burned': row[10] if len(row) > 10 else 0,
-                'last_reset_date': row[11] if len(row) > 11 else None
-            }
-        except IndexError:
-            return None
+        _remember_timezone(user_id, row[8] or DEFAULT_TIMEZONE)
+        return {
+            'user_id': row[0],
+            'weight': row[1],
+            'height': row[2],
+            'age': row[3],
+            'activity': row[4],
+            'city': row[5],
+            'water_goal': row[6],
+            'calorie_goal': row[7],
+            'timezone': row[8] or DEFAULT_TIMEZONE
+        }
     return None
 
-def add_log(user_id, log_type, value, amount):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+def _remember_timezone(user_id, timezone_name):
+    with _pending_lock:
+        _timezone_cache[user_id] = timezone_name
+        _timezone_cache.move_to_end(user_id)
+        while len(_timezone_cache) > DAILY_CACHE_SIZE:
+            _timezone_cache.popitem(last=False)
+
+def _user_timezone(user_id):
+    with _pending_lock:
+        timezone_name = _timezone_cache.get(user_id)
+        if timezone_name is not None:
+            _timezone_cache.move_to_end(user_id)
+            return timezone_name
     
-    _check_and_reset_daily_data(user_id, cur)
+    with _connection() as conn:
+        row = conn.execute('SELECT timezone FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    timezone_name = row[0] if row and row[0] else DEFAULT_TIMEZONE
+    _remember_timezone(user_id, timezone_name)
+    return timezone_name
+
+def add_log(user_id, log_type, value, amount, quantity=None):
+    # value - название еды или тренировки, quantity - граммы или минуты.
+    # День записи вычисляется один раз по часовому поясу пользователя
+    day = local_day(_user_timezone(user_id))
+    name = str(value).strip().lower() if value is not None and log_type != 'water' else None
+    entry = (user_id, log_type, name, quantity, float(amount), int(time.time()), day)
+    
+    if BATCH_WRITES:
+        with _pending_lock:
+            _pending_logs.append(entry)
+            _update_daily_cache(entry)
+            if len(_pending_logs) >= BATCH_SIZE:
+                _flush_wakeup.set()
+        return True
+    
+    with _flush_lock:
+        with _connection() as conn:
+            names = _write_logs(conn.cursor(), [entry])
+            conn.commit()
+        _remember_names(names)
+        with _pending_lock:
+            _update_daily_cache(entry)
+    return True
+
+def _name_id(cursor, name, names):
+    # Вызывается под _flush_lock. Id, найденные или вставленные в текущей
+    # транзакции, копятся в names и попадают в кэш только после commit:
+    # при откате вставленное название исчезает, а его id SQLite выдаст другому
+    name_id = names.get(name)
+    if name_id is not None:
+        return name_id
+    name_id = _log_names.get(name)
+    if name_id is not None:
+        _log_names.move_to_end(name)
+        return name_id
     
-    cur.execute('''
-    INSERT INTO logs (user_id, type, value, amount)
-    VALUES (?, ?, ?, ?)
-    ''', (user_id, log_type, str(value), float(amount)))
+    row = cursor.execute('SELECT id FROM log_names WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        cursor.execute('INSERT INTO log_names (name) VALUES (?)', (name,))
+        name_id = cursor.lastrowid
+    else:
+        name_id = row[0]
+    names[name] = name_id
+    return name_id
+
+def _remember_names(names):
+    # Только для id из закоммиченной транзакции
+    for name, name_id in names.items():
+        _log_names[name] = name_id
+        _log_names.move_to_end(name)
+    while len(_log_names) > DAILY_CACHE_SIZE:
+        _log_names.popitem(last=False)
+
+def _write_logs(cursor, entries):
+    # Возвращает id новых для кэша названий: вызывающий передаёт их в
+    # _remember_names после commit
+    names = {}
+    cursor.executemany('''
+    INSERT INTO logs (user_id, type, name_id, quantity, amount, created_at, day)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(user_id, LOG_TYPES[log_type], _name_id(cursor, name, names) if name is not None else None,
+           quantity, amount, created_at, _day_number(day))
+          for user_id, log_type, name, quantity, amount, created_at, day in entries])
     
+    # Итоги дня обновляются в той же транзакции, одной строкой на пользователя и день
+    summary = {}
+    for user_id, log_type, _, _, amount, _, day in entries:
+        row = summary.setdefault((user_id, day), [0, 0, 0, 0, 0])
+        if log_type == 'water':
+            row[0] += amount
+        elif log_type == 'food':
+            row[1] += amount
+            row[3] += 1
+        elif log_type == 'workout':
+            row[2] += amount
+            row[4] += 1
+    cursor.executemany('''
+    INSERT INTO daily_summary (user_id, day, water, food_kcal, burned_kcal, food_count, workout_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, day) DO UPDATE SET
+        water = water + excluded.water,
+        food_kcal = food_kcal + excluded.food_kcal,
+        burned_kcal = burned_kcal + excluded.burned_kcal,
+        food_count = food_count + excluded.food_count,
+        workout_count = workout_count + excluded.workout_count
+    ''', [key + tuple(row) for key, row in summary.items()])
+    return names
+
+def flush_logs():
+    with _flush_lock:
+        with _pending_lock:
+            batch = _pending_logs[:]
+            del _pending_logs[:]
+        if not batch:
+            return 0
+        
+        try:
+            with _connection() as conn:
+                names = _write_logs(conn.cursor(), batch)
+                conn.commit()
+            _remember_names(names)
+        except Exception:
+            with _pending_lock:
+                _pending_logs[:0] = batch
+            raise
+        return len(batch)
+
+def _flusher():
+    while not _flush_stop.is_set():
+        _flush_wakeup.wait(BATCH_INTERVAL_MS / 1000)
+        _flush_wakeup.clear()
+        try:
+            flush_logs()
+        except Exception as e:
+            print(f"Ошибка при записи логов: {e}")
+
+def _start_flusher():
+    global _flush_thread
+    if _flush_thread is None or not _flush_thread.is_alive():
+        _flush_stop.clear()
+        _flush_thread = threading.Thread(target=_flusher, name='db-flusher', daemon=True)
+        _flush_thread.start()
+
+def _stop_flusher():
+    global _flush_thread
+    if _flush_thread is not None:
+        _flush_stop.set()
+        _flush_wakeup.set()
+        _flush_thread.join()
+        _flush_thread = None
+
+def _drop_pending_logs(user_id):
+    with _pending_lock:
+        _pending_logs[:] = [entry for entry in _pending_logs if entry[0] != user_id]
+
+def _water_total(value):
+    # Целые суммы воды показываем без ".0"
+    return int(value) if float(value).is_integer() else value
+
+def _add_to_totals(totals, log_type, amount):
     if log_type == 'water':
-        cur.execute('''
-        UPDATE users SET water_drank = water_drank + ? 
-        WHERE user_id = ?
-        ''', (float(amount), user_id))
+        totals['water_total'] += amount
     elif log_type == 'food':
-        cur.execute('''
-        UPDATE users SET calories_eaten = calories_eaten + ? 
-        WHERE user_id = ?
-        ''', (float(amount), user_id))
+        totals['food_total'] += amount
+        totals['food_count'] += 1
     elif log_type == 'workout':
-        cur.execute('''
-        UPDATE users SET calories_burned = calories_burned + ? 
-        WHERE user_id = ?
-        ''', (float(amount), user_id))
-    
-    conn.commit()
-    conn.close()
-    return True
+        totals['workout_total'] += amount
+        totals['workout_count'] += 1
 
-def _check_and_reset_daily_data(user_id, cursor):
-    cursor.execute('SELECT last_reset_date FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
+def _update_daily_cache(entry):
+    user_id, log_type, _, _, amount, _, day = entry
+    totals = _daily_cache.get(user_id)
+    if totals is None:
+        return
     
-    if result and result[0]:
-        last_reset = date.fromisoformat(result[0])
-        today = date.today()
-        
-        if last_reset < today:
-            cursor.execute('''
-            UPDATE users SET 
-                water_drank = 0,
-                calories_eaten = 0,
-                calories_burned = 0,
-                last_reset_date = ?
-            WHERE user_id = ?
-            ''', (today.isoformat(), user_id))
+    if day == totals['day']:
+        _add_to_totals(totals, log_type, amount)
+        _daily_cache.move_to_end(user_id)
+    elif day > totals['day']:
+        # Наступили новые сутки: итоги прошлого дня больше не нужны
+        del _daily_cache[user_id]
+
+def _invalidate_daily_cache(user_id):
+    with _pending_lock:
+        _daily_cache.pop(user_id, None)
 
 def get_today_stats(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+    # Итоги за день считаются по логам за текущие локальные сутки пользователя,
+    # поэтому сбрасывать счётчики в полночь не нужно
+    with _pending_lock:
+        totals = _daily_cache.get(user_id)
+        if totals is not None and totals['day'] == local_day(totals['timezone']):
+            _daily_cache.move_to_end(user_id)
+            daily_cache_stats['hits'] += 1
+            totals = dict(totals)
+        else:
+            daily_cache_stats['misses'] += 1
+            totals = None
     
-    _check_and_reset_daily_data(user_id, cur)
-    conn.commit()
-    
-    user = get_user(user_id)
-    if not user:
-        conn.close()
-        return {}
-    
-    cur.execute('''
-    SELECT type, COUNT(*) as count, SUM(amount) as total
-    FROM logs 
-    WHERE user_id = ? AND DATE(created_at) = DATE('now')
-    GROUP BY type
-    ''', (user_id,))
-    
-    stats = {
-        'food_count': 0,
-        'workout_count': 0,
-        'food_total': 0,
-        'workout_total': 0,
-        'water_total': 0}
-    
-    for log_type, count, total in cur.fetchall():
-        if log_type == 'food':
-            stats['food_count'] = count
-            stats['food_total'] = total or 0
-        elif log_type == 'workout':
-            stats['workout_count'] = count
-            stats['workout_total'] = total or 0
-        elif log_type == 'water':
-            stats['water_total'] = total or 0
-    
-    conn.close()
+    if totals is None:
+        totals = _load_daily_totals(user_id)
+        if totals is None:
+            return {}
     
+    total_water = _water_total(totals['water_total'])
     return {
-        'total_water': user['water_drank'],
-        'total_calories': user['calories_eaten'],
-        'total_burned': user['calories_burned'],
-        'water_goal': user['water_goal'],
-        'calorie_goal': user['calorie_goal'],
-        'calorie_balance': user['calories_eaten'] - user['calories_burned'],
-        'water_percentage': (user['water_drank'] / user['water_goal'] * 100) if user['water_goal'] > 0 else 0,
-        **stats}
+        # Локальный день пользователя, за который посчитаны итоги (ГГГГ-ММ-ДД)
+        'day': totals['day'],
+        'total_water': total_water,
+        'total_calories': totals['food_total'],
+        'total_burned': totals['workout_total'],
+        'water_goal': totals['water_goal'],
+        'calorie_goal': totals['calorie_goal'],
+        'calorie_balance': totals['food_total'] - totals['workout_total'],
+        'water_percentage': (total_water / totals['water_goal'] * 100) if totals['water_goal'] > 0 else 0,
+        'food_count': totals['food_count'],
+        'workout_count': totals['workout_count'],
+        'food_total': totals['food_total'],
+        'workout_total': totals['workout_total'],
+        'water_total': totals['water_total']}
 
-def clear_user_logs(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    try:
-        cur.execute('DELETE FROM logs WHERE user_id = ?', (user_id,))
+def _load_daily_totals(user_id):
+    # Блокировка сброса нужна, чтобы запись не была учтена дважды: и в базе,
+    # и в очереди отложенной записи
+    with _flush_lock, _connection() as conn:
+        cur = conn.cursor()
         
+        user = _get_user(cur, user_id)
+        if not user:
+            return None
+        
+        day = local_day(user['timezone'])
         cur.execute('''
-        UPDATE users SET 
-            water_drank = 0,
-            calories_eaten = 0,
-            calories_burned = 0,
-            last_reset_date = ?
-        WHERE user_id = ?
-        ''', (date.today().isoformat(), user_id))
+        SELECT type, COUNT(*) as count, SUM(amount) as total
+        FROM logs 
+        WHERE user_id = ? AND day = ?
+        GROUP BY type
+        ''', (user_id, _day_number(day)))
+        rows = [(LOG_TYPE_NAMES.get(log_type), count, total) for log_type, count, total in cur.fetchall()]
         
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"Ошибка при очистке логов: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+        totals = {
+            'day': day,
+            'timezone': user['timezone'],
+            'water_goal': user['water_goal'],
+            'calorie_goal': user['calorie_goal'],
+            'food_count': 0,
+            'workout_count': 0,
+            'food_total': 0,
+            'workout_total': 0,
+            'water_total': 0}
+        
+        for log_type, count, total in rows:
+            if log_type == 'food':
+                totals['food_count'] = count
+                totals['food_total'] = total or 0
+            elif log_type == 'workout':
+                totals['workout_count'] = count
+                totals['workout_total'] = total or 0
+            elif log_type == 'water':
+                totals['water_total'] = total or 0
+        
+        with _pending_lock:
+            for entry_user_id, log_type, _, _, amount, _, entry_day in _pending_logs:
+                if entry_user_id == user_id and entry_day == day:
+                    _add_to_totals(totals, log_type, amount)
+            
+            _daily_cache[user_id] = totals
+            _daily_cache.move_to_end(user_id)
+            while len(_daily_cache) > DAILY_CACHE_SIZE:
+                _daily_cache.popitem(last=False)
+                daily_cache_stats['evictions'] += 1
+            return dict(totals)
+
+def _delete_in_batches(statement, params):
+    # statement удаляет не больше RETENTION_BATCH строк (последний параметр - LIMIT);
+    # каждая пачка - своя короткая транзакция
+    deleted = 0
+    while True:
+        with _connection() as conn:
+            count = conn.execute(statement, params + (RETENTION_BATCH,)).rowcount
+            conn.commit()
+        deleted += count
+        if count < RETENTION_BATCH:
+            return deleted
+
+def clear_user_logs(user_id):
+    with _flush_lock:
+        _drop_pending_logs(user_id)
+        _invalidate_daily_cache(user_id)
+        
+        try:
+            _delete_in_batches('DELETE FROM logs WHERE id IN (SELECT id FROM logs WHERE user_id = ? LIMIT ?)', (user_id,))
+            with _connection() as conn:
+                conn.execute('DELETE FROM daily_summary WHERE user_id = ?', (user_id,))
+                conn.commit()
+            return True
+        except Exception as e:
+            print(f"Ошибка при очистке логов: {e}")
+            return False
 
 def get_user_history(user_id, days=7):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute('''
-    SELECT type, value, amount, created_at
-    FROM logs 
-    WHERE user_id = ? AND DATE(created_at) >= DATE('now', ?)
-    ORDER BY created_at DESC
-    ''', (user_id, f'-{days} days'))
+    # Отложенные записи сюда не попадают: перед чтением их сбрасывает вызывающий
+    since = local_day(_user_timezone(user_id), datetime.now(timezone.utc) - timedelta(days=days))
+    with _connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute('''
+        SELECT l.type, n.name, l.quantity, l.amount, DATETIME(l.created_at, 'unixepoch')
+        FROM logs l
+        LEFT JOIN log_names n ON n.id = l.name_id
+        WHERE l.user_id = ? AND l.day >= ?
+        ORDER BY l.created_at DESC
+        ''', (user_id, _day_number(since)))
+        rows = cur.fetchall()
     
     history = []
-    for row in cur.fetchall():
+    for row in rows:
+        log_type = LOG_TYPE_NAMES.get(row[0])
         history.append({
-            'type': row[0],
-            'value': row[1],
-            'amount': row[2],
-            'created_at': row[3]
+            'type': log_type,
+            'value': _log_value(log_type, row[1], row[2]),
+            'quantity': row[2],
+            'amount': row[3],
+            'created_at': row[4]
         })
     
-    conn.close()
     return history
 
-def delete_user(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+def get_daily_summaries(user_id, days=7):
+    # Отчёт за N дней читает N коротких строк daily_summary вместо всех логов
+    # периода; дни без записей в результат не попадают. Отложенные записи, как
+    # и в get_user_history, сбрасывает вызывающий
+    since = local_day(_user_timezone(user_id), datetime.now(timezone.utc) - timedelta(days=days - 1))
+    with _connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute('''
+        SELECT day, water, food_kcal, burned_kcal, food_count, workout_count
+        FROM daily_summary
+        WHERE user_id = ? AND day >= ?
+        ORDER BY day
+        ''', (user_id, since))
+        rows = cur.fetchall()
     
-    try:
-        cur.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+    summaries = []
+    for row in rows:
+        summaries.append({
+            'day': row[0],
+            'water_total': _water_total(row[1]),
+            'food_total': row[2],
+            'workout_total': row[3],
+            'food_count': row[4],
+            'workout_count': row[5]
+        })
+    
+    return summaries
+
+def delete_user(user_id):
+    with _flush_lock, _connection() as conn:
+        _drop_pending_logs(user_id)
+        _invalidate_daily_cache(user_id)
+        with _pending_lock:
+            _timezone_cache.pop(user_id, None)
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            cur.execute('DELETE FROM daily_summary WHERE user_id = ?', (user_id,))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Ошибка при удалении пользователя: {e}")
+            conn.rollback()
+            return False
+
+def get_user_cities():
+    with _connection() as conn:
+        return [city for (city,) in conn.execute('SELECT DISTINCT city FROM users WHERE city IS NOT NULL')]
+
+def iter_goal_profiles(chunk):
+    # Пользователи читаются страницами по user_id: каждая страница - короткое
+    # чтение, и между страницами бот свободно пишет в базу
+    last_id = -2 ** 63
+    while True:
+        with _connection() as conn:
+            rows = conn.execute('''
+            SELECT user_id, city, weight, height, age, activity, water_goal, calorie_goal
+            FROM users
+            WHERE user_id > ?
+                AND weight IS NOT NULL AND height IS NOT NULL AND age IS NOT NULL AND activity IS NOT NULL
+            ORDER BY user_id
+            LIMIT ?
+            ''', (last_id, chunk)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def update_goals(goals):
+    # goals - [(water_goal, calorie_goal, user_id, weight, height, age, activity, city), ...]:
+    # после user_id - профиль, по которому считались нормы. Если пользователь успел
+    # изменить профиль (/setprofile), строка пропускается, чтобы не затереть его
+    # новые нормы старыми. Возвращает число обновлённых строк.
+    # Запускается из goals.py, отдельно от бота: в кэше итогов дня у бота прежние
+    # нормы остаются до конца локальных суток пользователя или вытеснения из кэша
+    with _connection() as conn:
+        cur = conn.executemany('''
+        UPDATE users SET water_goal = ?, calorie_goal = ?
+        WHERE user_id = ? AND weight = ? AND height = ? AND age = ? AND activity = ? AND city IS ?
+        ''', goals)
         conn.commit()
-        return True
-    except Exception as e:
-        print(f"Ошибка при удалении пользователя: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+        return cur.rowcount
 
 def reset_daily_data(user_id):
     return clear_user_logs(user_id)
 
 def get_all_users():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute('''
-    SELECT user_id, city, water_drank, calories_eaten, calories_burned
-    FROM users
-    ORDER BY user_id
-    ''')
+    with _connection() as conn:
+        cur = conn.cursor()
+        
+        # "Сегодня" у каждого пояса своё: локальные дни передаются таблицей zones
+        cur.execute('SELECT DISTINCT COALESCE(timezone, ?) FROM users', (DEFAULT_TIMEZONE,))
+        zones = [(name, _day_number(local_day(name))) for (name,) in cur.fetchall()] or [(DEFAULT_TIMEZONE, _day_number(local_day(DEFAULT_TIMEZONE)))]
+        
+        cur.execute(f'''
+        WITH zones(timezone, day) AS (VALUES {', '.join(['(?, ?)'] * len(zones))})
+        SELECT u.user_id, u.city,
+            COALESCE(SUM(CASE WHEN l.type = 1 THEN l.amount END), 0),
+            COALESCE(SUM(CASE WHEN l.type = 2 THEN l.amount END), 0),
+            COALESCE(SUM(CASE WHEN l.type = 3 THEN l.amount END), 0)
+        FROM users u
+        JOIN zones z ON z.timezone = COALESCE(u.timezone, ?)
+        LEFT JOIN logs l ON l.user_id = u.user_id AND l.day = z.day
+        GROUP BY u.user_id
+        ORDER BY u.user_id
+        ''', [value for zone in zones for value in zone] + [DEFAULT_TIMEZONE])
+        rows = cur.fetchall()
     
     users = []
-    for row in cur.fetchall():
+    for row in rows:
         users.append({
             'user_id': row[0],
             'city': row[1],
-            'water_drank': row[2],
+            'water_drank': _water_total(row[2]),
             'calories_eaten': row[3],
             'calories_burned': row[4]
         })
     
-    conn.close()
-    return users
\ No newline at end of file
+    return users
+
+def save_food_cache(query, calories):
+    with _connection() as conn:
+        conn.execute('''
+        INSERT OR REPLACE INTO food_cache (query, calories, updated_at)
+        VALUES (?, ?, ?)
+        ''', (query, calories, time.time()))
+        conn.commit()
+
+def load_food_cache():
+    with _connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT query, calories, updated_at FROM food_cache')
+        return {query: (calories, updated_at) for query, calories, updated_at in cur.fetchall()}
+
+def get_fsm_record(key):
+    with _connection() as conn:
+        return conn.execute(
+            'SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,)).fetchone()
+
+# set_fsm_state и set_fsm_data возвращают запись целиком, как get_fsm_record:
+# по ней SQLiteStorage обновляет свой кэш без лишнего чтения
+def set_fsm_state(key, state):
+    with _connection() as conn:
+        record = conn.execute('''
+        INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        RETURNING state, data, updated_at
+        ''', (key, state, time.time())).fetchone()
+        conn.commit()
+        return record
+
+def set_fsm_data(key, data):
+    with _connection() as conn:
+        record = conn.execute('''
+        INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        RETURNING state, data, updated_at
+        ''', (key, data, time.time())).fetchone()
+        conn.commit()
+        return record
+
+def delete_expired_fsm(updated_before):
+    with _connection() as conn:
+        cur = conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (updated_before,))
+        conn.commit()
+        return cur.rowcount
+
+def count_fsm_sessions(updated_after):
+    with _connection() as conn:
+        return conn.execute(
+            'SELECT COUNT(*) FROM fsm_states WHERE state IS NOT NULL AND updated_at >= ?',
+            (updated_after,)).fetchone()[0]
+
+_ARCHIVE_FIELDS = ('id', 'user_id', 'type', 'name', 'quantity', 'amount', 'created_at', 'day')
+# Ключ (created_at, id) последней записи, дописанной в архив. Если процесс упал между
+# записью архива и DELETE, следующий запуск удалит эти строки, не архивируя их повторно
+_ARCHIVE_MARK = '.archived'
+
+def _read_archive_mark(archive_dir):
+    try:
+        with open(os.path.join(archive_dir, _ARCHIVE_MARK)) as f:
+            created_at, log_id = f.read().split()
+        return int(created_at), int(log_id)
+    except (OSError, ValueError):
+        return None
+
+def _write_archive_mark(archive_dir, mark):
+    path = os.path.join(archive_dir, _ARCHIVE_MARK)
+    with open(path + '.tmp', 'w') as f:
+        f.write(f'{mark[0]} {mark[1]}')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+def _archive_logs(archives, archive_dir, rows, mark):
+    # Один файл на месяц; каждый запуск дописывает в него новый gzip-поток,
+    # gzip и zcat читают такие файлы целиком
+    rows = [row for row in rows if mark is None or (row[8], row[0]) > mark]
+    if not rows:
+        return mark
+    for row in rows:
+        record = dict(zip(_ARCHIVE_FIELDS, row))
+        record['type'] = LOG_TYPE_NAMES.get(record['type'])
+        record['day'] = _day_text(record['day'])
+        month = record['created_at'][:7]
+        archive = archives.get(month)
+        if archive is None:
+            os.makedirs(archive_dir, exist_ok=True)
+            archive = archives[month] = gzip.open(
+                os.path.join(archive_dir, f'logs-{month}.jsonl.gz'), 'at', encoding='utf-8')
+        archive.write(json.dumps(record, ensure_ascii=False) + '\n')
+    # Записи и отметка о них попадают на диск до того, как строки будут удалены из базы
+    for archive in archives.values():
+        archive.flush()
+        os.fsync(archive.fileno())
+    mark = rows[-1][8], rows[-1][0]
+    _write_archive_mark(archive_dir, mark)
+    return mark
+
+def purge_old_logs(retention_days=RETENTION_DAYS, archive_dir=RETENTION_ARCHIVE_DIR):
+    # Логи старше срока хранения переносятся в архив и удаляются пачками;
+    # итоги этих дней остаются в daily_summary
+    if retention_days <= 0:
+        return 0
+    
+    cutoff = int(time.time()) - retention_days * 86400
+    archives = {}
+    mark = _read_archive_mark(archive_dir) if archive_dir else None
+    deleted = 0
+    try:
+        while not _maintenance_stop.is_set():
+            with _connection() as conn:
+                rows = conn.execute('''
+                SELECT l.id, l.user_id, l.type, n.name, l.quantity, l.amount,
+                    DATETIME(l.created_at, 'unixepoch'), l.day, l.created_at
+                FROM logs l
+                LEFT JOIN log_names n ON n.id = l.name_id
+                WHERE l.created_at < ?
+                ORDER BY l.created_at, l.id
+                LIMIT ?
+                ''', (cutoff, RETENTION_BATCH)).fetchall()
+            if not rows:
+                break
+            
+            if archive_dir:
+                mark = _archive_logs(archives, archive_dir, rows, mark)
+            with _connection() as conn:
+                conn.executemany('DELETE FROM logs WHERE id = ?', [(row[0],) for row in rows])
+                conn.commit()
+            deleted += len(rows)
+            if len(rows) < RETENTION_BATCH:
+                break
+    finally:
+        for archive in archives.values():
+            archive.close()
+    
+    if deleted:
+        compact_db()
+    return deleted
+
+def compact_db():
+    # Свободные страницы возвращаются ОС порциями по VACUUM_PAGES, каждая порция -
+    # отдельная транзакция; полный VACUUM не нужен после миграции 4
+    freed = 0
+    while not _maintenance_stop.is_set():
+        with _connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                break
+            pages = min(conn.execute('PRAGMA freelist_count').fetchone()[0], VACUUM_PAGES)
+            if not pages:
+                # Файл базы уменьшается только после переноса WAL в основной файл.
+                # PASSIVE не ждёт читателей: TRUNCATE при открытом снимке (выгрузка
+                # admin.py) держал бы запись бота весь busy timeout. Что не перенеслось
+                # сейчас, перенесёт следующий автоматический checkpoint
+                conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+                break
+            conn.execute(f'PRAGMA incremental_vacuum({pages})').fetchall()
+            conn.commit()
+        freed += pages
+    return freed
+
+def stop_maintenance():
+    # Прерывает purge_old_logs и compact_db после текущей пачки
+    _maintenance_stop.set()
+
+def get_db_size():
+    with _connection() as conn:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return {'bytes': page_size * pages, 'free_bytes': page_size * free}
\ No newline at end of file
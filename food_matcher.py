@@ -0,0 +1,167 @@
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+_WORD_RE = re.compile(r'\w+')
+
+# Окончания существительных и прилагательных, от длинных к коротким
+_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ией', 'ием', 'иях', 'ого', 'его', 'ому', 'ему',
+    'ыми', 'ими', 'ов', 'ев', 'ей', 'ой', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях',
+    'ую', 'юю', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ых', 'их',
+    'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о', 'ь', 'й'], key=len, reverse=True)
+_MIN_STEM = 3
+
+FUZZY_THRESHOLD = 0.35
+FUZZY_CANDIDATES = 20
+# Короче пяти букв опечатка не допускается (_typo_limit), а одна замена уже
+# даёт другой продукт: "вода" - "водка", "лось" - "лосось"
+FUZZY_MIN_LENGTH = 5
+
+def tokenize(text):
+    return _WORD_RE.findall(text.lower().replace('ё', 'е'))
+
+def stem(word):
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+def _edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def _typo_limit(text):
+    if len(text) >= 9:
+        return 2
+    return 1 if len(text) >= 5 else 0
+
+def _trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class FoodMatcher:
+    # Индекс строится один раз, а стоимость поиска зависит только от длины
+    # запроса, но не от размера словаря продуктов.
+
+    def __init__(self, foods):
+        self._foods = {}
+        for name, value in foods.items():
+            self._foods.setdefault(' '.join(tokenize(name)), value)
+        self._max_words = max((len(key.split()) for key in self._foods), default=0)
+        
+        # Суффиксы названий, начинающиеся с границы слова: "капуста", "цветная капуста"
+        suffixes = set()
+        for key in self._foods:
+            words = key.split()
+            for i in range(len(words)):
+                suffixes.add((' '.join(words[i:]), key))
+        self._suffixes = sorted(suffixes)
+        
+        # Названия по основам слов: "яблоки", "яблоком" -> "яблок"
+        self._stems = {}
+        for key in sorted(self._foods, key=len):
+            self._stems.setdefault(' '.join(stem(word) for word in key.split()), key)
+        
+        self._keys = sorted(self._foods)
+        self._trigram_index = defaultdict(list)
+        self._trigram_counts = []
+        for key_id, key in enumerate(self._keys):
+            grams = _trigrams(' '.join(stem(word) for word in key.split()))
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._trigram_index[gram].append(key_id)
+
+    def __len__(self):
+        return len(self._foods)
+
+    def __contains__(self, key):
+        return key in self._foods
+
+    def find(self, text):
+        # Самое длинное название, которое входит в текст как последовательность
+        # слов; последнее слово может быть с окончанием ("бананы" -> "банан").
+        words = tokenize(text)
+        best = None
+        for i in range(len(words)):
+            for n in range(1, min(self._max_words, len(words) - i) + 1):
+                head = ' '.join(words[i:i + n - 1])
+                last = words[i + n - 1]
+                for end in range(len(last), 0, -1):
+                    candidate = f"{head} {last[:end]}" if head else last[:end]
+                    if candidate in self._foods:
+                        if best is None or len(candidate) > len(best):
+                            best = candidate
+                        break
+        return best
+
+    def find_stem(self, text):
+        # Самая длинная последовательность слов, совпадающая по основам
+        stems = [stem(word) for word in tokenize(text)]
+        best = None
+        for i in range(len(stems)):
+            for n in range(min(self._max_words, len(stems) - i), 0, -1):
+                key = self._stems.get(' '.join(stems[i:i + n]))
+                if key is not None:
+                    if best is None or len(key) > len(best):
+                        best = key
+                    break
+        return best
+
+    def complete(self, text):
+        # Название, одно из слов которого начинается с запроса ("ябл" -> "яблоко")
+        query = ' '.join(tokenize(text))
+        if not query:
+            return None
+        pos = bisect_left(self._suffixes, (query,))
+        if pos < len(self._suffixes) and self._suffixes[pos][0].startswith(query):
+            return self._suffixes[pos][1]
+        return None
+
+    def fuzzy(self, text, threshold=FUZZY_THRESHOLD):
+        # Поиск с опечатками: кандидаты по общим триграммам основ, затем
+        # расстояние редактирования ("бонан" -> "банан"). Коэффициент Дайса
+        # только отсекает кандидатов: сам по себе он пропускал "вареники" -> "варенье"
+        words = tokenize(text)
+        query = ' '.join(words)
+        if len(query) < FUZZY_MIN_LENGTH:
+            return None
+        grams = _trigrams(' '.join(stem(word) for word in words))
+        limit = _typo_limit(query)
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self._trigram_index.get(gram, ()))
+        best, best_rank = None, None
+        for key_id, common in overlap.most_common(FUZZY_CANDIDATES):
+            key = self._keys[key_id]
+            distance = _edit_distance(query, key, limit)
+            score = 2 * common / (len(grams) + self._trigram_counts[key_id])
+            if distance > limit or score <= threshold:
+                continue
+            rank = (distance, -score, key)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = key, rank
+        return best
+
+    def match(self, text):
+        for lookup in (self.find, self.find_stem, self.complete, self.fuzzy):
+            key = lookup(text)
+            if key is not None:
+                return key
+        return None
+
+    def exact(self, text, default=None):
+        return self._foods.get(' '.join(tokenize(text)), default)
+
+    def get(self, text, default=None):
+        key = self.match(text)
+        return self._foods[key] if key is not None else default
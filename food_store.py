@@ -0,0 +1,231 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from functools import lru_cache
+
+from config import FOOD_STORE_PATH
+from food_matcher import tokenize, stem
+
+# Офлайн-база продуктов: таблица foods (название + КБЖУ на 100 г) и FTS5-индекс по
+# названиям. Файл строится командой `python food_store.py import <дамп>` и
+# открывается только при первом поиске, поэтому на старт бота не влияет
+
+IMPORT_BATCH = 10000
+MAX_NAME_LENGTH = 200
+# Больше 900 ккал на 100 г не бывает даже у чистого жира: такие строки - ошибки в дампе
+MAX_KCAL = 900
+
+_conn = None
+_conn_version = None
+_conn_lock = threading.Lock()
+
+def normalize_name(name):
+    return ' '.join(tokenize(name))
+
+def _version():
+    # (inode, mtime) файла базы или None, если его нет. import_dump подменяет файл
+    # через os.replace, поэтому после импорта версия другая
+    try:
+        stat = os.stat(FOOD_STORE_PATH)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def _connection(version):
+    # Вызывается под _conn_lock. Соединение со старым файлом закрывается, как
+    # только на диске появилась другая версия: работающий бот видит новую базу
+    # без перезапуска
+    global _conn, _conn_version
+    if version != _conn_version:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        if version is not None:
+            conn = sqlite3.connect(f'file:{FOOD_STORE_PATH}?mode=ro', uri=True, check_same_thread=False)
+            # Страницы читаются через mmap и делятся с кэшем ОС, а не копируются в процесс
+            conn.execute('PRAGMA mmap_size=268435456')
+            _conn = conn
+        _conn_version = version
+    return _conn
+
+def close():
+    global _conn, _conn_version
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        _conn_version = None
+    _find.cache_clear()
+
+def _from_tenths(value):
+    return value / 10 if value is not None else None
+
+def _row_to_product(row):
+    name, kcal, protein, fat, carbs = row
+    return {'name': name, 'calories': kcal / 10, 'protein': _from_tenths(protein),
+            'fat': _from_tenths(fat), 'carbs': _from_tenths(carbs)}
+
+# Версия файла входит в ключ кэша: результаты (и промахи, пока файла нет)
+# для прежней базы после импорта новой не используются
+@lru_cache(maxsize=4096)
+def _find(query, exact, version):
+    if version is None or not query:
+        return None
+
+    words = query.split()
+    with _conn_lock:
+        conn = _connection(version)
+        if conn is None:
+            return None
+        if exact:
+            # Отдельного индекса по названию нет: точное совпадение ищется тоже через FTS
+            row = conn.execute(
+                'SELECT f.name, f.kcal, f.protein, f.fat, f.carbs FROM foods_fts '
+                'JOIN foods f ON f.rowid = foods_fts.rowid '
+                'WHERE foods_fts MATCH ? AND f.name = ? LIMIT 1',
+                (' AND '.join(f'"{word}"' for word in words), query)).fetchone()
+        else:
+            # "бананы сушеные" -> банан* AND сушен*; bm25 ставит короткие названия выше
+            row = conn.execute(
+                'SELECT f.name, f.kcal, f.protein, f.fat, f.carbs FROM foods_fts '
+                'JOIN foods f ON f.rowid = foods_fts.rowid '
+                'WHERE foods_fts MATCH ? ORDER BY rank LIMIT 1',
+                (' AND '.join(f'"{stem(word)}"*' for word in words),)).fetchone()
+    return _row_to_product(row) if row else None
+
+def find_exact(food_name):
+    return _find(normalize_name(food_name), True, _version())
+
+def find(food_name):
+    version = _version()
+    query = normalize_name(food_name)
+    return _find(query, True, version) or _find(query, False, version)
+
+def _tenths(value):
+    # Значения хранятся целыми в десятых долях (52.3 -> 523): SQLite пишет
+    # небольшие целые в 1-2 байта вместо 8 байт REAL
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return round(value * 10) if value >= 0 else None
+
+def _product_row(name, kcal, protein, fat, carbs):
+    name = normalize_name(name or '')
+    kcal = _tenths(kcal)
+    if not name or len(name) > MAX_NAME_LENGTH or not kcal or kcal > MAX_KCAL * 10:
+        return None
+    return name, kcal, _tenths(protein), _tenths(fat), _tenths(carbs)
+
+def _read_jsonl(stream):
+    for line in stream:
+        try:
+            product = json.loads(line)
+        except ValueError:
+            continue
+        nutriments = product.get('nutriments') or {}
+        row = _product_row(
+            product.get('product_name_ru') or product.get('product_name'),
+            nutriments.get('energy-kcal_100g'),
+            nutriments.get('proteins_100g'),
+            nutriments.get('fat_100g'),
+            nutriments.get('carbohydrates_100g'))
+        if row:
+            yield row
+
+def _read_csv(stream):
+    # CSV-дамп OpenFoodFacts разделён табуляцией, свои выгрузки - обычно запятой
+    header = stream.readline()
+    delimiter = '\t' if '\t' in header else ','
+    csv.field_size_limit(sys.maxsize)
+    reader = csv.DictReader(stream, fieldnames=next(csv.reader([header], delimiter=delimiter)), delimiter=delimiter)
+    for product in reader:
+        row = _product_row(
+            product.get('product_name_ru') or product.get('product_name'),
+            product.get('energy-kcal_100g'),
+            product.get('proteins_100g'),
+            product.get('fat_100g'),
+            product.get('carbohydrates_100g'))
+        if row:
+            yield row
+
+def _open_dump(path):
+    raw = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace', newline='')
+
+def import_dump(path, db_path=FOOD_STORE_PATH):
+    # Строим базу во временном файле и подменяем целиком: работающий бот
+    # никогда не видит наполовину загруженный индекс
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('''
+        CREATE TABLE foods (
+            name TEXT NOT NULL,
+            kcal INTEGER NOT NULL,
+            protein INTEGER,
+            fat INTEGER,
+            carbs INTEGER
+        )
+    ''')
+
+    read = _read_csv if '.csv' in os.path.basename(path) else _read_jsonl
+    with _open_dump(path) as stream:
+        rows = read(stream)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH:
+                conn.executemany('INSERT INTO foods VALUES (?, ?, ?, ?, ?)', batch)
+                batch.clear()
+        conn.executemany('INSERT INTO foods VALUES (?, ?, ?, ?, ?)', batch)
+
+    # Дубли названий убираются одним проходом с временной сортировкой, без
+    # постоянного UNIQUE-индекса, который удвоил бы размер файла
+    conn.execute('DELETE FROM foods WHERE rowid NOT IN (SELECT MIN(rowid) FROM foods GROUP BY name)')
+
+    # Индекс без копии названий (content='foods'); detail=none был бы на треть
+    # меньше, но ранжирование по bm25 на частых словах с ним в 3-5 раз медленнее
+    conn.execute("CREATE VIRTUAL TABLE foods_fts USING fts5(name, content='foods', content_rowid='rowid')")
+    conn.execute('INSERT INTO foods_fts(rowid, name) SELECT rowid, name FROM foods')
+    conn.execute("INSERT INTO foods_fts(foods_fts) VALUES('optimize')")
+    conn.commit()
+    count = conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0]
+    conn.execute('VACUUM')
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    close()
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Офлайн-база продуктов')
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='загрузить дамп OpenFoodFacts (.jsonl/.csv, можно .gz)')
+    importer.add_argument('dump')
+    finder = commands.add_parser('find', help='найти продукт')
+    finder.add_argument('name', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        start = time.perf_counter()
+        count = import_dump(args.dump)
+        print(f"✅ Загружено продуктов: {count} за {time.perf_counter() - start:.1f} с "
+              f"({os.path.getsize(FOOD_STORE_PATH) / 1024 / 1024:.1f} МБ)")
+    else:
+        product = find(' '.join(args.name))
+        print(product if product else "❌ Не найдено")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+import async_database
+
+# Незавершённые сценарии (например, /setprofile) забываются через FSM_TTL секунд
+FSM_TTL = int(os.getenv('FSM_TTL', 24 * 3600))
+# Сколько записей fsm_states держать в памяти процесса
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+
+class SQLiteStorage(BaseStorage):
+    # Состояния FSM хранятся в таблице fsm_states той же базы, поэтому
+    # переживают перезапуск и доступны нескольким процессам бота.
+    # Перед таблицей стоит кэш с записью насквозь: апдейты одного пользователя
+    # обрабатывает один воркер, поэтому его запись меняет только этот процесс.
+    # В кэше лежат и отсутствующие записи (None): у большинства апдейтов
+    # состояния нет, и за ним не нужно ходить в базу
+
+    def __init__(self, ttl=FSM_TTL, key_builder=None, cache_size=FSM_CACHE_SIZE):
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def _remember(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _get_record(self, key):
+        key = self.key_builder.build(key)
+        if key in self._cache:
+            record = self._cache[key]
+            self._cache.move_to_end(key)
+        else:
+            record = await async_database.get_fsm_record(key)
+            # Пока шло чтение, запись могла обновиться: её версия в кэше новее
+            if key not in self._cache:
+                self._remember(key, record)
+        if record is None or record[2] < time.time() - self.ttl:
+            return None, {}
+        state, data, _ = record
+        return state, json.loads(data) if data else {}
+
+    async def set_state(self, key, state=None):
+        if isinstance(state, State):
+            state = state.state
+        key = self.key_builder.build(key)
+        self._remember(key, await async_database.set_fsm_state(key, state))
+
+    async def get_state(self, key):
+        state, _ = await self._get_record(key)
+        return state
+
+    async def set_data(self, key, data):
+        key = self.key_builder.build(key)
+        self._remember(key, await async_database.set_fsm_data(key, json.dumps(data, ensure_ascii=False)))
+
+    async def get_data(self, key):
+        _, data = await self._get_record(key)
+        return data
+
+    async def purge_expired(self):
+        updated_before = time.time() - self.ttl
+        for key in [key for key, record in self._cache.items() if record is not None and record[2] < updated_before]:
+            del self._cache[key]
+        return await async_database.delete_expired_fsm(updated_before)
+
+    async def close(self):
+        pass
@@ -0,0 +1,90 @@
+import argparse
+import time
+
+import numpy as np
+
+import database
+from utils import fetch_weather
+
+# Пересчёт норм воды и калорий у всех пользователей: после смены погоды или
+# формулы. Запускается отдельно от бота (cron): python goals.py
+
+GOALS_CHUNK = 50000
+# Температура, если у пользователя не указан город (как у get_weather без ключа API)
+DEFAULT_TEMP = 20.0
+
+def calculate_goals_batch(weight, height, age, activity, temp):
+    # Векторный вариант utils.calculate_goals: те же формулы и тот же порядок
+    # операций над массивами NumPy, поэтому результаты совпадают поэлементно
+    base_water = np.where(temp < 0, weight * 30 * 0.9, weight * 30)
+    activity_water = np.where(activity > 0, (activity // 30) * 200, 0)
+    weather_water = np.select([temp > 30, temp > 25], [1000, 500], 0)
+    water_goal = np.round((base_water + activity_water + weather_water) / 100) * 100
+
+    bmr = 10 * weight + 6.25 * height - 5 * age + 5
+    activity_factor = np.select([activity < 30, activity < 60, activity < 90], [1.2, 1.375, 1.55], 1.725)
+    calorie_goal = np.round(bmr * activity_factor / 50) * 50
+    calorie_goal = np.where((age <= 0) | (weight <= 0) | (height <= 0), 2000, calorie_goal)
+
+    return water_goal.astype(np.int64), calorie_goal.astype(np.int64)
+
+def _temperature(temps, city):
+    # Без города - температура по умолчанию. Город, погоду которого узнать не
+    # удалось (или появившийся после начала пересчёта), - NaN: такие пользователи
+    # пропускаются, а не получают нормы по выдуманной температуре
+    return DEFAULT_TEMP if city is None else temps.get(city, np.nan)
+
+def recalculate_goals(chunk=GOALS_CHUNK, dry_run=False):
+    # Погода запрашивается один раз на город, а не на пользователя
+    temps = {}
+    for city in database.get_user_cities():
+        temp = fetch_weather(city)
+        if temp is not None:
+            temps[city] = temp
+
+    checked = changed = skipped = 0
+    for rows in database.iter_goal_profiles(chunk):
+        user_ids, cities, weight, height, age, activity, water_goal, calorie_goal = zip(*rows)
+        temp = np.array([_temperature(temps, city) for city in cities], dtype=float)
+        known = ~np.isnan(temp)
+        new_water, new_calories = calculate_goals_batch(
+            np.array(weight, dtype=float), np.array(height, dtype=float),
+            np.array(age, dtype=float), np.array(activity, dtype=float), temp)
+
+        # Записываются только изменившиеся нормы; NULL в базе - тоже изменение
+        mask = known & ((new_water != np.array(water_goal, dtype=float))
+                        | (new_calories != np.array(calorie_goal, dtype=float)))
+        # Вместе с нормами передаётся профиль, по которому они посчитаны:
+        # update_goals пропустит пользователей, изменивших его за это время
+        updates = []
+        for i, water, calories in zip(np.flatnonzero(mask).tolist(), new_water[mask].tolist(), new_calories[mask].tolist()):
+            user_id, city, *profile = rows[i][:6]
+            updates.append((water, calories, user_id, *profile, city))
+        if updates and not dry_run:
+            changed += database.update_goals(updates)
+        else:
+            changed += len(updates)
+
+        checked += len(rows)
+        skipped += len(rows) - int(known.sum())
+    return checked, changed, skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пересчёт норм воды и калорий у всех пользователей')
+    parser.add_argument('--chunk', type=int, default=GOALS_CHUNK, help='пользователей в пачке')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать, без записи в базу')
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    try:
+        start = time.perf_counter()
+        checked, changed, skipped = recalculate_goals(args.chunk, args.dry_run)
+        print(f"✅ Проверено профилей: {checked}, изменено норм: {changed} "
+              f"за {time.perf_counter() - start:.1f} с")
+        if skipped:
+            print(f"⚠️ Пропущено профилей без погоды: {skipped}")
+    finally:
+        database.close_db()
+
+if __name__ == "__main__":
+    main()
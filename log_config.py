@@ -0,0 +1,81 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from config import LOG_FILE, LOG_LEVEL, LOG_FORMAT, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT, LOG_SAMPLE_RATE
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Логгеры, пишущие по записи на каждый апдейт: их INFO-записи сэмплируются
+SAMPLED_LOGGERS = ('bot.messages', 'aiogram.event', 'aiohttp.access')
+
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra и попадает в JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.INFO or self.rate >= 1 or random.random() < self.rate
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    # Очередь внутри процесса: запись не сериализуется, поэтому подстановка
+    # аргументов откладывается до фонового потока
+    def prepare(self, record):
+        return record
+
+def _file_handler():
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+
+def setup_logging(log_queue=None):
+    # Цикл событий только кладёт запись в очередь, а форматирование и запись
+    # в файл/stdout выполняет фоновый поток QueueListener. Для воркеров
+    # передаётся multiprocessing.Queue: дочерние процессы пишут в неё же
+    if log_queue is None:
+        log_queue = queue.SimpleQueue()
+        queue_handler = LocalQueueHandler(log_queue)
+    else:
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [_file_handler(), logging.StreamHandler(sys.stdout)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    sampling = SamplingFilter(LOG_SAMPLE_RATE)
+    for name in SAMPLED_LOGGERS:
+        logging.getLogger(name).addFilter(sampling)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
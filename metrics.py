@@ -0,0 +1,200 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+
+from aiohttp import web
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+class _Value(_Metric):
+    def __init__(self, name, documentation, labels=(), callback=None):
+        # callback() -> {label_values: value} вызывается при каждом запросе /metrics
+        # вместо хранения значений: так счётчики модулей не дублируются
+        super().__init__(name, documentation, labels)
+        self._values = {}
+        self._callback = callback
+
+    def _samples(self):
+        if self._callback is not None:
+            values = list(self._callback().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{_labels_text(self.labels, key)} {_number(value)}" for key, value in values]
+
+class Counter(_Value):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+class Gauge(_Value):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label_values -> [счётчики по корзинам..., +Inf, сумма]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            data[i] += 1
+            data[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = [(key, list(data)) for key, data in self._values.items()]
+        lines = []
+        for key, data in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), data):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(self.labels, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {data[-1]!r}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {cumulative}")
+        return lines
+
+def timed(histogram, *label_values, errors=None):
+    # Декоратор: время вызова попадает в histogram, исключения - в счётчик errors
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(*label_values)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(*label_values)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+        return wrapper
+    return decorator
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+_caches = {}
+
+def register_cache(name, stats):
+    # stats() -> dict со счётчиками 'hits' и 'misses', если есть - 'evictions'
+    # (вытеснено по размеру) и 'coalesced' (промах дождался уже идущего запроса)
+    _caches[name] = stats
+
+def _cache_lookups():
+    values = {}
+    for name, stats in _caches.items():
+        data = stats()
+        values[(name, 'hit')] = data['hits']
+        values[(name, 'miss')] = data['misses']
+    return values
+
+def _cache_hit_ratio():
+    values = {}
+    for name, stats in _caches.items():
+        data = stats()
+        lookups = data['hits'] + data['misses']
+        values[(name,)] = data['hits'] / lookups if lookups else 0.0
+    return values
+
+def _cache_counter(field):
+    def values():
+        values = {}
+        for name, stats in _caches.items():
+            data = stats()
+            if field in data:
+                values[(name,)] = data[field]
+        return values
+    return values
+
+HANDLER_LATENCY = Histogram('bot_handler_seconds', 'Время обработки сообщения', ['command'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Необработанные исключения в обработчиках', ['command'])
+DB_LATENCY = Histogram('bot_db_seconds', 'Время выполнения функций database.py', ['function'])
+DB_ERRORS = Counter('bot_db_errors_total', 'Ошибки функций database.py', ['function'])
+EXTERNAL_LATENCY = Histogram('bot_external_request_seconds', 'Время запросов к внешним API', ['api'])
+EXTERNAL_REQUESTS = Counter('bot_external_requests_total', 'Запросы к внешним API по результату', ['api', 'result'])
+DB_SIZE = Gauge('bot_db_size_bytes', 'Размер файла базы и свободное место в нём', ['kind'])
+WIZARD_SESSIONS = Gauge('bot_wizard_sessions', 'Незавершённые анкеты /setprofile')
+CACHE_LOOKUPS = Counter('bot_cache_lookups_total', 'Обращения к кэшам', ['cache', 'result'], callback=_cache_lookups)
+CACHE_HIT_RATIO = Gauge('bot_cache_hit_ratio', 'Доля попаданий в кэш', ['cache'], callback=_cache_hit_ratio)
+CACHE_EVICTIONS = Counter('bot_cache_evictions_total', 'Записи, вытесненные из кэша по размеру', ['cache'],
+                          callback=_cache_counter('evictions'))
+CACHE_COALESCED = Counter('bot_cache_coalesced_total', 'Промахи кэша, дождавшиеся уже идущего запроса', ['cache'],
+                          callback=_cache_counter('coalesced'))
+
+async def _handle_metrics(request):
+    refresh = request.app['refresh']
+    if refresh is not None:
+        await refresh()
+    return web.Response(body=render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def start_metrics_server(host, port, refresh=None):
+    # refresh - корутина, обновляющая метрики, которые дорого считать на каждом событии
+    app = web.Application()
+    app['refresh'] = refresh
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Update
+
+from config import (BOT_WORKERS, RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST, RATE_LIMIT_GLOBAL_RATE,
+                    RATE_LIMIT_GLOBAL_BURST, RATE_LIMIT_FOOD_LOOKUP_RATE, RATE_LIMIT_FOOD_LOOKUP_BURST,
+                    RATE_LIMIT_PROFILE_RATE, RATE_LIMIT_PROFILE_BURST, SEND_GLOBAL_RATE, SEND_CHAT_RATE,
+                    SEND_CHAT_BURST, RATE_LIMIT_MAX_KEYS)
+from metrics import Counter
+from utils import food_needs_lookup
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = Counter('bot_rate_limited_total', 'Апдейты, отброшенные лимитером', ['bucket'])
+SEND_DELAYED = Counter('bot_send_delayed_seconds_total', 'Суммарная задержка исходящих запросов', ['reason'])
+
+# Повторы запроса после 429 от Telegram
+SEND_MAX_RETRIES = 3
+
+class RateLimiter:
+    # Token bucket на каждый ключ. Состояние - [токены, время] в LRU ограниченного
+    # размера: вытесненный ключ просто начинает с полной корзины
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def _take(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(self, key=None, cost=1):
+        bucket = self._take(key, time.monotonic())
+        if bucket[0] < cost:
+            return False
+        bucket[0] -= cost
+        return True
+
+    def reserve(self, key=None, cost=1):
+        # Токены уходят в минус: вызывающий ждёт возвращённое число секунд,
+        # поэтому запросы выстраиваются в очередь вместо отказа
+        bucket = self._take(key, time.monotonic())
+        bucket[0] -= cost
+        return -bucket[0] / self.rate if bucket[0] < 0 else 0.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+def _command(text):
+    if not text.startswith('/'):
+        return None, None
+    parts = text.split(maxsplit=2)
+    return parts[0].split('@')[0].lower(), parts[1] if len(parts) > 1 else None
+
+class RateLimitMiddleware(BaseMiddleware):
+    def __init__(self):
+        # Глобальный лимит делится между воркерами: у каждого процесса свои корзины
+        self.global_bucket = RateLimiter(RATE_LIMIT_GLOBAL_RATE / BOT_WORKERS, RATE_LIMIT_GLOBAL_BURST / BOT_WORKERS)
+        self.users = RateLimiter(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST)
+        self.food_lookups = RateLimiter(RATE_LIMIT_FOOD_LOOKUP_RATE, RATE_LIMIT_FOOD_LOOKUP_BURST)
+        self.profiles = RateLimiter(RATE_LIMIT_PROFILE_RATE, RATE_LIMIT_PROFILE_BURST)
+        # Не чаще одного предупреждения в 30 секунд на пользователя
+        self.notices = RateLimiter(1 / 30, 1)
+
+    async def _check(self, user_id, text):
+        # Сначала лимиты пользователя: апдейты, отброшенные ими, не тратят общий
+        # лимит, и один пользователь не может выбрать его за всех
+        if not self.users.acquire(user_id):
+            return 'user'
+
+        command, argument = _command(text)
+        if command == '/food' and argument and await food_needs_lookup(argument):
+            if not self.food_lookups.acquire(user_id):
+                return 'food_lookup'
+        elif command == '/profile':
+            if not self.profiles.acquire(user_id):
+                return 'profile'
+
+        if not self.global_bucket.acquire():
+            return 'global'
+        return None
+
+    async def __call__(self, handler, event: Update, data: dict):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        message = event.message if isinstance(event, Update) else None
+        text = (message.text or "") if message is not None else ""
+        bucket = await self._check(user.id, text)
+        if bucket is None:
+            return await handler(event, data)
+
+        RATE_LIMITED.inc(bucket)
+        logger.debug("Пользователь %s ограничен лимитом %s", user.id, bucket)
+        if message is not None and self.notices.acquire(user.id):
+            if bucket == 'food_lookup':
+                await message.answer("⏳ Слишком много поисков новых продуктов. Попробуйте через минуту\n"
+                                     "Без ограничений: яблоко, банан, курица, пицца, рис, творог")
+            else:
+                await message.answer("⏳ Слишком много запросов. Подождите немного и повторите")
+        return None
+
+class OutgoingThrottle(BaseRequestMiddleware):
+    # Исходящие запросы к Telegram ждут своей очереди в общем лимите и лимите
+    # чата, а после ответа 429 повторяются через retry_after
+
+    def __init__(self):
+        self.global_bucket = RateLimiter(SEND_GLOBAL_RATE / BOT_WORKERS, max(1, SEND_GLOBAL_RATE / BOT_WORKERS))
+        self.chats = RateLimiter(SEND_CHAT_RATE, SEND_CHAT_BURST)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None:
+            delay = max(self.chats.reserve(chat_id), self.global_bucket.reserve())
+            if delay > 0:
+                SEND_DELAYED.inc('throttle', amount=delay)
+                await asyncio.sleep(delay)
+
+        for attempt in range(SEND_MAX_RETRIES):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == SEND_MAX_RETRIES - 1:
+                    raise
+                logger.warning("Telegram просит подождать %s с перед %s", e.retry_after, type(method).__name__)
+                SEND_DELAYED.inc('retry_after', amount=e.retry_after)
+                await asyncio.sleep(e.retry_after)
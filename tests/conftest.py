@@ -0,0 +1,62 @@
+import os
+import sys
+
+import asyncio
+
+import pytest
+from aiogram import Bot
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:test-token')
+os.environ.setdefault('OPENWEATHER_API_KEY', '')
+
+import database
+
+
+def _reset_state():
+    database._pending_logs.clear()
+    database._daily_cache.clear()
+    database._timezone_cache.clear()
+    database._log_names.clear()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'health.db'))
+    _reset_state()
+    database.init_db()
+    yield database
+    database.close_db()
+    _reset_state()
+
+
+@pytest.fixture
+def batch_db(db, monkeypatch):
+    # Отложенная запись без фонового потока: сброс вызывается в тесте явно
+    monkeypatch.setattr(database, 'BATCH_WRITES', True)
+    return db
+
+
+@pytest.fixture
+def user(db):
+    db.save_user(1, weight=70, height=180, age=30, activity=45, city='Москва',
+                 water_goal=2300, calorie_goal=2400)
+    return 1
+
+
+class TelegramStub:
+    # Запросы к Telegram не уходят в сеть: ответы бота складываются в sent
+    def __init__(self):
+        self.sent = []
+        self.delay = 0
+
+    async def call(self, bot, method, request_timeout=None):
+        await asyncio.sleep(self.delay)
+        self.sent.append((method.chat_id, method.text))
+
+
+@pytest.fixture
+def telegram(db, monkeypatch):
+    telegram = TelegramStub()
+    monkeypatch.setattr(Bot, '__call__', lambda bot, method, request_timeout=None: telegram.call(bot, method))
+    return telegram
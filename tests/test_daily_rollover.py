@@ -0,0 +1,107 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiogram.types import Update
+
+import bot as bot_module
+import database
+from timezones import local_day
+
+
+# 20:59:59 UTC - последняя секунда 1 марта в Москве (UTC+3)
+BEFORE_MIDNIGHT = datetime(2026, 3, 1, 20, 59, 59, tzinfo=timezone.utc)
+
+
+class Clock:
+    def __init__(self, moment):
+        self.moment = moment
+
+    def local_day(self, timezone_name, moment=None):
+        return local_day(timezone_name, moment or self.moment)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(BEFORE_MIDNIGHT)
+    monkeypatch.setattr(database, 'local_day', clock.local_day)
+    return clock
+
+
+def _summary(user_id):
+    conn = sqlite3.connect(database.DB_NAME)
+    try:
+        return conn.execute('SELECT day, water FROM daily_summary WHERE user_id = ? ORDER BY day',
+                            (user_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_totals_start_from_zero_after_midnight(user, clock):
+    database.add_log(user, 'water', 'вода', 300)
+    assert database.get_today_stats(user)['total_water'] == 300
+
+    clock.moment += timedelta(seconds=1)
+    stats = database.get_today_stats(user)
+    assert (stats['total_water'], stats['total_calories'], stats['food_count']) == (0, 0, 0)
+
+    database.add_log(user, 'water', 'вода', 200)
+    assert database.get_today_stats(user)['total_water'] == 200
+    assert _summary(user) == [('2026-03-01', 300), ('2026-03-02', 200)]
+
+
+def test_log_after_midnight_replaces_cached_day(user, clock):
+    database.add_log(user, 'water', 'вода', 300)
+    database.get_today_stats(user)
+    assert database._daily_cache[user]['day'] == '2026-03-01'
+
+    clock.moment += timedelta(minutes=1)
+    database.add_log(user, 'water', 'вода', 200)
+    assert user not in database._daily_cache
+    assert database.get_today_stats(user)['total_water'] == 200
+
+
+def test_pending_logs_of_previous_day_are_not_counted(batch_db, user, clock):
+    database.add_log(user, 'water', 'вода', 300)
+    clock.moment += timedelta(seconds=1)
+    database.add_log(user, 'water', 'вода', 200)
+    database._daily_cache.clear()
+
+    assert database.get_today_stats(user)['total_water'] == 200
+    database.flush_logs()
+    assert _summary(user) == [('2026-03-01', 300), ('2026-03-02', 200)]
+
+
+def test_midnight_follows_user_timezone(user, clock):
+    database.save_user(2, weight=60, height=165, age=25, activity=0, city='Владивосток',
+                       water_goal=1800, calorie_goal=1900)
+    # 14:59:59 UTC: во Владивостоке (UTC+10) 00:59:59 следующего дня, в Москве - 17:59:59
+    clock.moment = BEFORE_MIDNIGHT - timedelta(hours=6)
+    database.add_log(user, 'water', 'вода', 300)
+    database.add_log(2, 'water', 'вода', 400)
+
+    clock.moment = BEFORE_MIDNIGHT + timedelta(seconds=1)
+    assert database.get_today_stats(user)['total_water'] == 0
+    assert database.get_today_stats(2)['total_water'] == 400
+    assert _summary(user) == [('2026-03-01', 300)]
+    assert _summary(2) == [('2026-03-02', 400)]
+
+
+def _feed(text, user_id):
+    update = Update.model_validate({
+        'update_id': 1,
+        'message': {'message_id': 1, 'date': int(BEFORE_MIDNIGHT.timestamp()), 'text': text,
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'}}},
+        context={'bot': bot_module.bot})
+    asyncio.run(bot_module.dp.feed_update(bot_module.bot, update))
+
+
+@pytest.mark.parametrize('command, header', [('/progress', '📊 Прогресс за 02.03.2026'),
+                                             ('/tips', '💡 Персональные рекомендации на 02.03.2026')])
+def test_header_date_is_users_local_day(user, clock, telegram, command, header):
+    # По UTC ещё 1 марта, в Москве уже 2-е: дата в заголовке - день итогов
+    clock.moment = BEFORE_MIDNIGHT + timedelta(minutes=30)
+    _feed(command, user)
+    assert telegram.sent[-1][1].startswith(header)
@@ -0,0 +1,70 @@
+import json
+import os
+import asyncio
+import threading
+
+import food_store
+import utils
+
+
+def _fake_store(monkeypatch, product):
+    calls = []
+    def find_exact(food_name):
+        calls.append(threading.current_thread().name)
+        return product
+    monkeypatch.setattr(food_store, 'find_exact', find_exact)
+    monkeypatch.setattr(food_store, 'find', lambda food_name: None)
+    return calls
+
+
+def test_store_lookup_runs_off_the_event_loop_once_per_update(monkeypatch):
+    product = {'name': 'киноа', 'calories': 368.0, 'protein': 14.1, 'fat': 6.1, 'carbs': 57.2}
+    calls = _fake_store(monkeypatch, product)
+
+    async def update():
+        # Лимитер, затем обработчик /food - в одной задаче апдейта
+        assert not await utils.food_needs_lookup('киноа')
+        assert await utils.get_calories_async('киноа') == 368.0
+        return await utils.find_local_food('киноа')
+
+    assert asyncio.run(update()) == (368.0, product)
+    assert len(calls) == 1
+    assert calls[0].startswith('food-store')
+
+    # Следующий апдейт ищет заново
+    asyncio.run(update())
+    assert len(calls) == 2
+
+
+def test_food_db_hit_skips_the_store(monkeypatch):
+    calls = _fake_store(monkeypatch, None)
+    assert asyncio.run(utils.find_local_food('Яблоко')) == (52, None)
+    assert calls == []
+
+
+def _build(tmp_path, name, kcal):
+    dump = tmp_path / f'{kcal}.jsonl'
+    dump.write_text(json.dumps({'product_name': name, 'nutriments': {'energy-kcal_100g': kcal}}, ensure_ascii=False) + '\n',
+                    encoding='utf-8')
+    built = str(tmp_path / f'{kcal}.db')
+    food_store.import_dump(str(dump), built)
+    return built
+
+
+def test_store_is_reopened_when_the_file_is_replaced(monkeypatch, tmp_path):
+    # Импорт запускают отдельным процессом (`python food_store.py import`):
+    # в процессе бота close() не вызывается, файл просто подменяется
+    first, second = _build(tmp_path, 'Киноа', 368), _build(tmp_path, 'Киноа', 120)
+    db_path = str(tmp_path / 'foods.db')
+    monkeypatch.setattr(food_store, 'FOOD_STORE_PATH', db_path)
+    food_store.close()
+
+    # Пока базы нет, промах не должен застревать в кэше
+    assert food_store.find('киноа') is None
+
+    os.replace(first, db_path)
+    assert food_store.find('киноа')['calories'] == 368.0
+
+    os.replace(second, db_path)
+    assert food_store.find('киноа')['calories'] == 120.0
+    food_store.close()
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from config import FOOD_DB
+from food_matcher import FoodMatcher
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'data', 'food_forms.txt')
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return FoodMatcher(FOOD_DB)
+
+
+def _corpus():
+    with open(CORPUS, encoding='utf-8') as stream:
+        return [line.rstrip('\n').split('\t') for line in stream if line.strip() and not line.startswith('#')]
+
+
+def test_inflected_and_misspelled_forms_resolve_locally(matcher):
+    corpus = _corpus()
+    results = [(query, expected, matcher.match(query)) for query, expected in corpus]
+
+    # Нерешённые формы уходят в OpenFoodFacts, а неверное совпадение - это
+    # неверные калории в дневнике, поэтому их быть не должно совсем
+    assert [(query, found) for query, expected, found in results if found not in (expected, None)] == []
+    resolved = sum(found == expected for _, expected, found in results)
+    assert len(corpus) == 70
+    assert resolved >= 63
+
+
+@pytest.mark.parametrize('query', ['вода', 'вареники', 'молоток', 'лось', 'ирис', 'борщ', 'плов', 'сало'])
+def test_similar_words_are_not_matched(matcher, query):
+    assert matcher.match(query) is None
+
+
+def test_typos_need_small_edit_distance(matcher):
+    assert matcher.fuzzy('бонан') == 'банан'
+    assert matcher.fuzzy('яблако') == 'яблоко'
+    # Общих триграмм достаточно, но расстояние больше допустимого
+    assert matcher.fuzzy('вареники') is None
+    # Короткие запросы нечётким поиском не ищутся
+    assert matcher.fuzzy('вода') is None
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+import async_database
+import database
+from fsm_storage import SQLiteStorage
+
+
+def _key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def _count_reads(monkeypatch):
+    reads = []
+    get_fsm_record = async_database.get_fsm_record
+    async def counted(key):
+        reads.append(key)
+        return await get_fsm_record(key)
+    monkeypatch.setattr(async_database, 'get_fsm_record', counted)
+    return reads
+
+
+def test_reads_are_served_from_cache(db, monkeypatch):
+    reads = _count_reads(monkeypatch)
+    storage = SQLiteStorage()
+
+    async def scenario():
+        assert await storage.get_state(_key(1)) is None
+        assert await storage.get_data(_key(1)) == {}
+        await storage.set_state(_key(1), 'ProfileForm:weight')
+        await storage.set_data(_key(1), {'weight': 70.5})
+        return await storage.get_state(_key(1)), await storage.get_data(_key(1))
+
+    assert asyncio.run(scenario()) == ('ProfileForm:weight', {'weight': 70.5})
+    # Отсутствующая запись прочитана один раз, дальше - кэш и запись насквозь
+    assert len(reads) == 1
+
+    # Другой процесс с пустым кэшем видит то же самое в базе
+    assert asyncio.run(SQLiteStorage().get_data(_key(1))) == {'weight': 70.5}
+
+
+def test_cached_record_expires_after_ttl(db, monkeypatch):
+    storage = SQLiteStorage(ttl=60)
+
+    async def scenario():
+        await storage.set_state(_key(1), 'ProfileForm:city')
+        monkeypatch.setattr(time, 'time', lambda: real_time() + 61)
+        return await storage.get_state(_key(1))
+
+    real_time = time.time
+    assert asyncio.run(scenario()) is None
+
+
+def test_cache_is_bounded(db, monkeypatch):
+    reads = _count_reads(monkeypatch)
+    storage = SQLiteStorage(cache_size=2)
+
+    async def scenario():
+        for user_id in (1, 2, 3):
+            await storage.set_state(_key(user_id), 'ProfileForm:age')
+        assert len(storage._cache) == 2
+        return [await storage.get_state(_key(user_id)) for user_id in (3, 2, 1)]
+
+    assert asyncio.run(scenario()) == ['ProfileForm:age'] * 3
+    assert reads == [storage.key_builder.build(_key(1))]
+
+
+def test_purge_drops_expired_rows_and_cache_entries(db, monkeypatch):
+    storage = SQLiteStorage(ttl=60)
+    now = time.time()
+
+    async def scenario():
+        monkeypatch.setattr(time, 'time', lambda: now - 120)
+        await storage.set_state(_key(1), 'ProfileForm:weight')
+        monkeypatch.setattr(time, 'time', lambda: now)
+        await storage.set_state(_key(2), 'ProfileForm:weight')
+        return await storage.purge_expired()
+
+    assert asyncio.run(scenario()) == 1
+    assert list(storage._cache) == [storage.key_builder.build(_key(2))]
+    assert database.count_fsm_sessions(0) == 1
@@ -0,0 +1,76 @@
+import itertools
+
+import numpy as np
+
+import database
+import goals
+from utils import calculate_goals
+
+
+WEIGHTS = (0, 45.5, 70, 75, 83.3, 150)
+HEIGHTS = (0, 160, 180.5)
+AGES = (0, 18, 30, 65)
+ACTIVITIES = (0, 15, 29, 30, 59, 60, 89, 90, 240)
+TEMPS = (-15.0, -0.1, 0.0, 20.0, 25.0, 25.01, 30.0, 30.5)
+
+
+def test_batch_matches_scalar_on_every_branch():
+    # Границы всех условий формулы и ничьи при округлении (75 кг -> 2250 мл)
+    cases = list(itertools.product(WEIGHTS, HEIGHTS, AGES, ACTIVITIES, TEMPS))
+    weight, height, age, activity, temp = (np.array(column, dtype=float) for column in zip(*cases))
+
+    water, calories = goals.calculate_goals_batch(weight, height, age, activity, temp)
+
+    expected = [calculate_goals(*case) for case in cases]
+    assert water.tolist() == [water_goal for water_goal, _ in expected]
+    assert calories.tolist() == [calorie_goal for _, calorie_goal in expected]
+
+
+def test_batch_matches_scalar_on_random_profiles():
+    rng = np.random.default_rng(25)
+    weight = rng.uniform(30, 200, 10000).round(1)
+    height = rng.uniform(120, 220, 10000).round(1)
+    age = rng.integers(1, 100, 10000).astype(float)
+    activity = rng.integers(0, 300, 10000).astype(float)
+    temp = rng.uniform(-30, 40, 10000).round(2)
+
+    water, calories = goals.calculate_goals_batch(weight, height, age, activity, temp)
+
+    expected = [calculate_goals(*case) for case in zip(weight.tolist(), height.tolist(), age.tolist(),
+                                                       activity.tolist(), temp.tolist())]
+    assert list(zip(water.tolist(), calories.tolist())) == expected
+
+
+def test_users_without_weather_are_skipped(db, monkeypatch):
+    database.save_user(1, weight=70, height=180, age=30, activity=45, city='Москва')
+    database.save_user(2, weight=70, height=180, age=30, activity=45, city='Атлантида',
+                       water_goal=1000, calorie_goal=1000)
+    database.save_user(3, weight=70, height=180, age=30, activity=45)
+    monkeypatch.setattr(goals, 'fetch_weather', lambda city: 32.0 if city == 'Москва' else None)
+
+    assert goals.recalculate_goals(chunk=2) == (3, 2, 1)
+
+    assert database.get_user(1)['water_goal'] == calculate_goals(70, 180, 30, 45, 32.0)[0]
+    assert database.get_user(2)['water_goal'] == 1000
+    assert database.get_user(3)['water_goal'] == calculate_goals(70, 180, 30, 45, goals.DEFAULT_TEMP)[0]
+
+
+def test_profile_changed_during_recalculation_is_kept(db, monkeypatch):
+    database.save_user(1, weight=70, height=180, age=30, activity=45, city='Москва',
+                       water_goal=1000, calorie_goal=1000)
+    database.save_user(2, weight=80, height=175, age=40, activity=0, city='Москва',
+                       water_goal=1000, calorie_goal=1000)
+    monkeypatch.setattr(goals, 'fetch_weather', lambda city: 20.0)
+
+    iter_goal_profiles = database.iter_goal_profiles
+    def profiles_changed_after_read(chunk):
+        for rows in iter_goal_profiles(chunk):
+            # /setprofile в боте между чтением страницы и записью норм
+            database.save_user(1, weight=90, height=180, age=30, activity=45, city='Москва',
+                               water_goal=3100, calorie_goal=2900)
+            yield rows
+    monkeypatch.setattr(database, 'iter_goal_profiles', profiles_changed_after_read)
+
+    assert goals.recalculate_goals() == (2, 1, 0)
+    assert (database.get_user(1)['water_goal'], database.get_user(1)['calorie_goal']) == (3100, 2900)
+    assert database.get_user(2)['water_goal'] == calculate_goals(80, 175, 40, 0, 20.0)[0]
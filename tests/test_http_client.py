@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import food_store
+import utils
+
+
+DELAY = 0.3
+
+
+class StubFoodApi:
+    # Отвечает как поиск OpenFoodFacts с задержкой и считает одновременные запросы
+    def __init__(self):
+        self.active = self.peak = self.requests = 0
+
+    async def search(self, request):
+        self.requests += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(DELAY)
+        finally:
+            self.active -= 1
+        return web.json_response({'products': [{'nutriments': {'energy-kcal_100g': 123}}]})
+
+
+async def _lookup_concurrently(monkeypatch, count):
+    api = StubFoodApi()
+    app = web.Application()
+    app.router.add_get('/cgi/search.pl', api.search)
+    server = TestServer(app, host='127.0.0.1')
+    await server.start_server()
+    monkeypatch.setattr(utils, 'FOOD_SEARCH_URL', str(server.make_url('/cgi/search.pl')))
+    await utils.init_http()
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(utils.get_calories_async(f'стабпродукт{i}') for i in range(count)))
+        return api, results, time.perf_counter() - start
+    finally:
+        await utils.close_http()
+        await server.close()
+
+
+def _offline(monkeypatch):
+    monkeypatch.setattr(food_store, 'find_exact', lambda food_name: None)
+    monkeypatch.setattr(food_store, 'find', lambda food_name: None)
+    monkeypatch.setattr(utils, '_food_cache', {})
+
+
+def test_concurrent_food_lookups_overlap(db, monkeypatch):
+    _offline(monkeypatch)
+    api, results, elapsed = asyncio.run(_lookup_concurrently(monkeypatch, 8))
+
+    assert results == [123] * 8
+    assert api.requests == 8
+    assert api.peak == 8
+    # Последовательно вышло бы 8 * DELAY
+    assert elapsed < 3 * DELAY
+
+
+def test_per_host_limit_caps_concurrency(db, monkeypatch):
+    _offline(monkeypatch)
+    count = utils.HTTP_PER_HOST_LIMIT + 5
+    api, results, elapsed = asyncio.run(_lookup_concurrently(monkeypatch, count))
+
+    assert results == [123] * count
+    assert api.peak == utils.HTTP_PER_HOST_LIMIT
+    assert elapsed < 4 * DELAY
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+import numpy as np
+from aiogram.types import Update
+
+import bot as bot_module
+import database
+import workers
+from ratelimit import RateLimiter
+
+
+# Нагрузочный тест: тысячи одновременных апдейтов через Dispatcher, как при
+# утреннем пике. Размер меняется через LOAD_UPDATES; задержки печатаются с -s
+LOAD_UPDATES = int(os.getenv('LOAD_UPDATES', 2000))
+LOAD_USERS = 200
+COMMANDS = ('/water 250', '/food яблоко 150', '/progress', '/workout бег 30')
+
+
+def _update(update_id, user_id, text):
+    return Update.model_validate({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'}}},
+        context={'bot': bot_module.bot})
+
+
+def test_concurrent_updates_latency(telegram, monkeypatch):
+    # Измеряются обработчики и база, а не лимитер
+    monkeypatch.setattr(RateLimiter, 'acquire', lambda self, key=None, cost=1: True)
+    for user_id in range(1, LOAD_USERS + 1):
+        database.save_user(user_id, weight=70, height=180, age=30, activity=45, city='Москва',
+                           water_goal=2300, calorie_goal=2400)
+    updates = [_update(i, i % LOAD_USERS + 1, COMMANDS[i % len(COMMANDS)]) for i in range(LOAD_UPDATES)]
+
+    async def feed(update):
+        start = time.perf_counter()
+        await bot_module.dp.feed_update(bot_module.bot, update)
+        return time.perf_counter() - start
+
+    async def run():
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(feed(update) for update in updates))
+        return latencies, time.perf_counter() - start
+
+    latencies, elapsed = asyncio.run(run())
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"\nDispatcher: {LOAD_UPDATES} апдейтов за {elapsed:.2f} с ({LOAD_UPDATES / elapsed:.0f} в секунду), "
+          f"p50 {p50:.1f} мс, p99 {p99:.1f} мс")
+
+    assert len(telegram.sent) == LOAD_UPDATES
+    assert not any(text.startswith('❌') for _, text in telegram.sent)
+    water = database.get_today_stats(1)['total_water']
+    assert water == 250 * sum(1 for i in range(LOAD_UPDATES) if i % LOAD_USERS == 0 and i % len(COMMANDS) == 0)
+
+
+def _raw_update(update_id, user_id, text):
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                        'chat': {'id': user_id, 'type': 'private'},
+                        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'}}}
+
+
+def _run_workers(count, updates):
+    # Генератор нагрузки: тот же маршрутизатор, что у фронта в run_workers
+    start = time.perf_counter()
+    queues, processes = workers.start_workers(count)
+    route = workers.make_router(queues)
+    for update in updates:
+        route(update)
+    workers.stop_workers(queues, processes)
+    return time.perf_counter() - start
+
+
+def test_workers_scale_and_keep_per_user_order(telegram, monkeypatch):
+    # Воркеры - процессы через fork: подмены ниже и путь к базе они наследуют
+    monkeypatch.setattr(RateLimiter, 'acquire', lambda self, key=None, cost=1: True)
+    monkeypatch.setattr(workers, 'METRICS_PORT', 0)
+    for user_id in range(1, LOAD_USERS + 1):
+        database.save_user(user_id, weight=70, height=180, age=30, activity=45, city='Москва',
+                           water_goal=2300, calorie_goal=2400)
+    # Основная нагрузка - /progress у всех пользователей, и ещё у первого
+    # пользователя серия /water, которая должна записаться строго по порядку
+    updates = [_raw_update(i, i % LOAD_USERS + 1, '/progress') for i in range(LOAD_UPDATES)]
+    updates[::LOAD_UPDATES // 50] = [_raw_update(i, 1, f'/water {100 + i}')
+                                     for i in range(0, LOAD_UPDATES, LOAD_UPDATES // 50)]
+
+    timings = {count: _run_workers(count, updates) for count in (1, 4)}
+    print(f"\nВоркеры: {LOAD_UPDATES} апдейтов - 1 воркер {timings[1]:.2f} с, 4 воркера {timings[4]:.2f} с, "
+          f"ускорение {timings[1] / timings[4]:.1f}x на {os.cpu_count()} CPU")
+
+    conn = sqlite3.connect(database.DB_NAME)
+    try:
+        amounts = [amount for (amount,) in conn.execute('SELECT amount FROM logs WHERE user_id = 1 ORDER BY id')]
+    finally:
+        conn.close()
+    expected = [100.0 + i for i in range(0, LOAD_UPDATES, LOAD_UPDATES // 50)]
+    assert amounts == expected * 2
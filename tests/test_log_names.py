@@ -0,0 +1,25 @@
+import database
+
+
+def test_rolled_back_name_is_not_cached(db, user):
+    # Два новых одинаковых названия в одной пачке, затем откат транзакции
+    entry = (user, 'food', 'плов', 200, 300.0, 1_800_000_000, '2027-01-15')
+    with db._flush_lock:
+        with db._connection() as conn:
+            db._write_logs(conn.cursor(), [entry, entry])
+            conn.rollback()
+
+    db.add_log(user, 'food', 'борщ', 120, 250)
+    db.add_log(user, 'food', 'плов', 180, 200)
+
+    values = sorted(item['value'] for item in db.get_user_history(user))
+    assert values == ['борщ (250г)', 'плов (200г)']
+
+
+def test_committed_names_are_cached_and_reused(db, user):
+    db.add_log(user, 'workout', 'Бег', 280, 30)
+    db.add_log(user, 'workout', 'бег', 300, 32)
+
+    assert list(db._log_names) == ['бег']
+    with db._connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM log_names').fetchone()[0] == 1
@@ -0,0 +1,64 @@
+import gzip
+import json
+import threading
+import time
+
+import pytest
+
+import admin
+import database
+
+
+def test_compaction_does_not_block_writes_behind_a_reader(user):
+    database.add_log(user, 'water', 'вода', 300)
+    # Выгрузка держит снимок базы, а бот после этого продолжает писать
+    reader = admin.connect(database.DB_NAME)
+    try:
+        reader.execute('SELECT COUNT(*) FROM logs').fetchone()
+        database.add_log(user, 'water', 'вода', 200)
+
+        compaction = threading.Thread(target=database.compact_db)
+        compaction.start()
+        time.sleep(0.2)
+        start = time.perf_counter()
+        database.add_log(user, 'water', 'вода', 100)
+        elapsed = time.perf_counter() - start
+        compaction.join(database.POOL_TIMEOUT + 5)
+
+        assert elapsed < 1
+        assert not compaction.is_alive()
+    finally:
+        reader.close()
+    assert database.get_today_stats(user)['total_water'] == 600
+
+
+def _archived_ids(archive_dir):
+    ids = []
+    for path in sorted(archive_dir.glob('logs-*.jsonl.gz')):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            ids.extend(json.loads(line)['id'] for line in f)
+    return ids
+
+
+def test_purge_after_a_crash_does_not_archive_rows_twice(user, tmp_path, monkeypatch):
+    for amount in (100, 200, 300):
+        database.add_log(user, 'water', 'вода', amount)
+    with database._connection() as conn:
+        conn.execute('UPDATE logs SET created_at = created_at - 200 * 86400')
+        conn.commit()
+    monkeypatch.setattr(database, 'RETENTION_BATCH', 2)
+    archive_dir = tmp_path / 'archive'
+
+    # Процесс падает после записи первой пачки в архив, до DELETE
+    archive_logs = database._archive_logs
+    def crash(*args):
+        archive_logs(*args)
+        raise SystemExit
+    monkeypatch.setattr(database, '_archive_logs', crash)
+    with pytest.raises(SystemExit):
+        database.purge_old_logs(180, str(archive_dir))
+    monkeypatch.setattr(database, '_archive_logs', archive_logs)
+
+    assert database.purge_old_logs(180, str(archive_dir)) == 3
+    ids = _archived_ids(archive_dir)
+    assert len(ids) == len(set(ids)) == 3
@@ -0,0 +1,30 @@
+import database
+import metrics
+import utils
+
+
+def test_cache_evictions_and_coalesced_are_exported(monkeypatch):
+    monkeypatch.setitem(utils.weather_cache_stats, 'evictions', 7)
+    monkeypatch.setitem(utils.weather_cache_stats, 'coalesced', 3)
+    monkeypatch.setitem(database.daily_cache_stats, 'evictions', 2)
+
+    lines = metrics.render().splitlines()
+
+    assert 'bot_cache_evictions_total{cache="weather"} 7' in lines
+    assert 'bot_cache_evictions_total{cache="daily_totals"} 2' in lines
+    assert 'bot_cache_coalesced_total{cache="weather"} 3' in lines
+    # У кэша продуктов нет вытеснения: ряда нет, а не нулевой ряд
+    assert not any(line.startswith('bot_cache_evictions_total{cache="food"}') for line in lines)
+
+
+def test_daily_cache_counts_evictions(user, monkeypatch):
+    monkeypatch.setattr(database, 'DAILY_CACHE_SIZE', 1)
+    database.save_user(2, weight=60, height=165, age=25, activity=0, city='Казань',
+                       water_goal=1800, calorie_goal=1900)
+    evictions = database.daily_cache_stats['evictions']
+
+    database.get_today_stats(user)
+    database.get_today_stats(2)
+
+    assert database.daily_cache_stats['evictions'] == evictions + 1
+    assert list(database._daily_cache) == [2]
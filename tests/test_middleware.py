@@ -0,0 +1,27 @@
+import asyncio
+import logging
+
+import pytest
+from aiogram.types import Update
+
+import bot as bot_module
+
+
+def _message(text):
+    return Update.model_validate({
+        'update_id': 1,
+        'message': {'message_id': 1, 'date': 0, 'text': text,
+                    'chat': {'id': 100, 'type': 'private'},
+                    'from': {'id': 100, 'is_bot': False, 'first_name': 'Тест'}}})
+
+
+async def _handler(event, data):
+    return None
+
+
+@pytest.mark.parametrize('text, command', [('/water 300', '/water'), ('/food@health_bot яблоко 100', '/food'),
+                                           ('/start', '/start'), ('яблоко', None), ('', None)])
+def test_message_log_carries_command_name(caplog, text, command):
+    with caplog.at_level(logging.INFO, logger='bot.messages'):
+        asyncio.run(bot_module.LoggingMiddleware()(_handler, _message(text), {}))
+    assert caplog.records[-1].command == command
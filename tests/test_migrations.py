@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+import database
+
+
+def _columns(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    finally:
+        conn.close()
+
+
+def _version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_fresh_database_is_at_latest_version(db):
+    assert _version(db.DB_NAME) == len(db._MIGRATIONS)
+    assert 'name_id' in _columns(db.DB_NAME, 'logs')
+
+
+def test_interrupted_migration_rolls_back_and_reruns(tmp_path, monkeypatch):
+    path = str(tmp_path / 'health.db')
+    monkeypatch.setattr(database, 'DB_NAME', path)
+    # База в состоянии до миграции 5 со старыми текстовыми логами
+    monkeypatch.setattr(database, '_MIGRATIONS', database._MIGRATIONS[:4])
+    database.init_db()
+    with database._connection() as conn:
+        conn.execute("INSERT INTO users (user_id, timezone) VALUES (1, 'Europe/Moscow')")
+        conn.execute('''INSERT INTO logs (user_id, type, value, amount, created_at, day)
+                        VALUES (1, 'food', 'яблоко (200г)', 104, '2026-01-10 09:00:00', '2026-01-10')''')
+        conn.commit()
+    database.close_db()
+    monkeypatch.undo()
+
+    def crash(cursor):
+        raise RuntimeError('сбой посреди миграции')
+
+    monkeypatch.setattr(database, 'DB_NAME', path)
+    migrations = list(database._MIGRATIONS)
+    migrations[4] = [crash if step is database._compact_logs else step for step in migrations[4]]
+    monkeypatch.setattr(database, '_MIGRATIONS', migrations)
+    with pytest.raises(RuntimeError):
+        database.init_db()
+    database.close_db()
+
+    assert _version(path) == 4
+    conn = sqlite3.connect(path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert 'logs_compact' not in tables and 'log_names' not in tables
+
+    monkeypatch.undo()
+    monkeypatch.setattr(database, 'DB_NAME', path)
+    database.init_db()
+    try:
+        assert _version(path) == 5
+        history = database.get_user_history(1, days=10000)
+        assert [(h['type'], h['value'], h['quantity']) for h in history] == [('food', 'яблоко (200г)', 200.0)]
+    finally:
+        database.close_db()
+        database._log_names.clear()
+        database._timezone_cache.clear()
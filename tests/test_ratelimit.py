@@ -0,0 +1,35 @@
+import asyncio
+
+from ratelimit import RateLimiter, RateLimitMiddleware
+
+
+def _middleware(global_burst, user_burst):
+    middleware = RateLimitMiddleware()
+    # Корзины не пополняются: в тесте считаются только потраченные токены
+    middleware.global_bucket = RateLimiter(0, global_burst)
+    middleware.users = RateLimiter(0, user_burst)
+    return middleware
+
+
+def test_flooding_user_does_not_drain_global_bucket():
+    middleware = _middleware(global_burst=5, user_burst=2)
+
+    async def flood():
+        return [await middleware._check(1, 'привет') for _ in range(100)]
+
+    results = asyncio.run(flood())
+    assert results[:2] == [None, None]
+    assert set(results[2:]) == {'user'}
+
+    # Отброшенные апдейты первого пользователя общий лимит не потратили
+    assert asyncio.run(middleware._check(2, 'привет')) is None
+    assert middleware.global_bucket._buckets[None][0] == 2
+
+
+def test_global_bucket_still_limits_passing_updates():
+    middleware = _middleware(global_burst=2, user_burst=10)
+
+    async def check_users():
+        return [await middleware._check(user_id, '/water 200') for user_id in range(4)]
+
+    assert asyncio.run(check_users()) == [None, None, 'global', 'global']
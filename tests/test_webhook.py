@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import bot as bot_module
+
+
+SECRET = 'test-secret'
+
+
+def _update(update_id, user_id, text):
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                        'chat': {'id': user_id, 'type': 'private'},
+                        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'}}}
+
+
+def _run(scenario):
+    async def run():
+        client = TestClient(TestServer(bot_module.create_webhook_app(SECRET)))
+        await client.start_server()
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def _post(client, update, secret=SECRET):
+    return client.post('/webhook', json=update, headers={'X-Telegram-Bot-Api-Secret-Token': secret})
+
+
+def test_wrong_secret_is_rejected(telegram):
+    async def scenario(client):
+        for secret in ('wrong', ''):
+            response = await _post(client, _update(1, 100, '/start'), secret)
+            assert response.status == 401
+    _run(scenario)
+    assert telegram.sent == []
+
+
+def test_update_is_handled_before_response(telegram):
+    async def scenario(client):
+        response = await _post(client, _update(1, 100, '/water 300'))
+        assert response.status == 200
+        assert telegram.sent == [(100, '❌ Сначала создайте профиль: /setprofile')]
+    _run(scenario)
+
+
+def test_webhook_throughput(telegram):
+    count = 100
+
+    async def scenario(client):
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(_post(client, _update(i, 1000 + i, '/start')) for i in range(count)))
+        elapsed = time.perf_counter() - start
+        print(f"\nВебхук: {count} апдейтов за {elapsed:.2f} с ({count / elapsed:.0f} в секунду)")
+        return [response.status for response in responses]
+
+    assert _run(scenario) == [200] * count
+    assert sorted(chat_id for chat_id, _ in telegram.sent) == list(range(1000, 1000 + count))
+
+
+def test_shutdown_drains_in_flight_updates(telegram):
+    telegram.delay = 0.3
+
+    async def scenario(client):
+        request = asyncio.ensure_future(_post(client, _update(1, 100, '/start')))
+        await asyncio.sleep(0.1)
+        # Сервер останавливается, пока обработчик ещё ждёт ответа Telegram
+        await client.server.close()
+        response = await request
+        return response.status
+
+    assert _run(scenario) == 200
+    assert len(telegram.sent) == 1
@@ -0,0 +1,37 @@
+import asyncio
+import queue
+
+import bot as bot_module
+import workers
+
+
+def _updates(count, users):
+    return [{'update_id': i, 'message': {'message_id': i, 'text': f'/water {i}',
+                                         'chat': {'id': i % users, 'type': 'private'},
+                                         'from': {'id': i % users, 'is_bot': False, 'first_name': 'Тест'}}}
+            for i in range(count)]
+
+
+def test_worker_bounds_in_flight_updates_and_keeps_user_order(telegram, monkeypatch):
+    monkeypatch.setattr(workers, 'WORKER_CONCURRENCY', 8)
+    monkeypatch.setattr(workers, 'METRICS_PORT', 0)
+    handled = {}
+    peak = [0]
+
+    async def feed_raw_update(bot, update):
+        peak[0] = max(peak[0], len(asyncio.all_tasks()))
+        await asyncio.sleep(0.001)
+        message = update['message']
+        handled.setdefault(message['from']['id'], []).append(update['update_id'])
+    monkeypatch.setattr(bot_module.dp, 'feed_raw_update', feed_raw_update)
+
+    updates = queue.Queue()
+    for update in _updates(500, 5):
+        updates.put(update)
+    updates.put(None)
+    asyncio.run(workers._worker_loop(1, updates))
+
+    assert sum(map(len, handled.values())) == 500
+    assert all(ids == sorted(ids) for ids in handled.values())
+    # Задачи апдейтов плюс главная задача воркера
+    assert peak[0] <= 8 + 1
@@ -0,0 +1,143 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import async_database
+import database
+
+
+# Гарантии отложенной записи (DB_BATCH_WRITES=1):
+# - запись подтверждается пользователю до того, как попала в файл; итоги дня
+#   в памяти учитывают её сразу;
+# - сброс очереди - одна транзакция: после сбоя в базе либо вся пачка, либо ничего,
+#   а пачка возвращается в начало очереди в прежнем порядке;
+# - close_db сбрасывает очередь, поэтому штатная остановка ничего не теряет;
+# - при аварийном завершении процесса (kill -9, падение ОС) теряются записи,
+#   не сброшенные за последние DB_BATCH_INTERVAL_MS мс или DB_BATCH_SIZE записей.
+
+
+def _stored(user_id=None):
+    conn = sqlite3.connect(database.DB_NAME)
+    try:
+        if user_id is None:
+            return conn.execute('SELECT COUNT(*) FROM logs').fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM logs WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _crash():
+    # Процесс умер: память пропала, соединения закрыты без сброса очереди
+    with database._pool_lock:
+        pool, database._pool = database._pool, None
+    while not pool.empty():
+        pool.get_nowait().close()
+    database._pending_logs.clear()
+    database._daily_cache.clear()
+
+
+def test_pending_logs_count_in_today_stats_before_flush(batch_db, user):
+    database.get_today_stats(user)
+    database.add_log(user, 'water', 'вода', 300)
+    database.add_log(user, 'food', 'яблоко', 104, 200)
+
+    assert _stored() == 0
+    stats = database.get_today_stats(user)
+    assert (stats['total_water'], stats['total_calories']) == (300, 104)
+
+    assert database.flush_logs() == 2
+    assert _stored() == 2
+    assert database._pending_logs == []
+    assert database.get_today_stats(user)['total_water'] == 300
+
+
+def test_cold_today_stats_include_pending_logs(batch_db, user):
+    database.add_log(user, 'water', 'вода', 250)
+    database.flush_logs()
+    database.add_log(user, 'water', 'вода', 500)
+    database._daily_cache.clear()
+
+    assert database.get_today_stats(user)['total_water'] == 750
+
+
+def test_batch_size_wakes_flusher(batch_db, user, monkeypatch):
+    monkeypatch.setattr(database, 'BATCH_SIZE', 3)
+    database._flush_wakeup.clear()
+    database.add_log(user, 'water', 'вода', 100)
+    database.add_log(user, 'water', 'вода', 100)
+    assert not database._flush_wakeup.is_set()
+    database.add_log(user, 'water', 'вода', 100)
+    assert database._flush_wakeup.is_set()
+
+
+def test_failed_flush_is_atomic_and_requeued(batch_db, user, monkeypatch):
+    for amount in (100, 200, 300):
+        database.add_log(user, 'water', 'вода', amount)
+
+    write_logs = database._write_logs
+    def fail_after_insert(cursor, entries):
+        write_logs(cursor, entries)
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(database, '_write_logs', fail_after_insert)
+
+    with pytest.raises(sqlite3.OperationalError):
+        database.flush_logs()
+    assert _stored() == 0
+    database.add_log(user, 'water', 'вода', 400)
+    assert [entry[4] for entry in database._pending_logs] == [100, 200, 300, 400]
+
+    monkeypatch.setattr(database, '_write_logs', write_logs)
+    assert database.flush_logs() == 4
+    assert _stored() == 4
+
+
+def test_close_flushes_pending_logs(batch_db, user):
+    database.add_log(user, 'food', 'яблоко', 104, 200)
+    database.close_db()
+    assert _stored() == 1
+
+
+def test_crash_loses_only_unflushed_logs(batch_db, user):
+    database.add_log(user, 'water', 'вода', 300)
+    database.flush_logs()
+    database.add_log(user, 'water', 'вода', 500)
+
+    _crash()
+    database.init_db()
+
+    assert _stored() == 1
+    assert database.get_today_stats(user)['total_water'] == 300
+
+
+def test_clearing_user_drops_their_pending_logs(batch_db, user):
+    database.save_user(2, weight=60, height=165, age=25, activity=0, city='Казань')
+    database.add_log(user, 'water', 'вода', 300)
+    database.add_log(2, 'water', 'вода', 200)
+
+    database.clear_user_logs(user)
+    assert [entry[0] for entry in database._pending_logs] == [2]
+    assert database.get_today_stats(user)['total_water'] == 0
+
+    database.add_log(user, 'water', 'вода', 100)
+    database.delete_user(2)
+    assert [entry[0] for entry in database._pending_logs] == [user]
+
+    database.flush_logs()
+    assert (_stored(user), _stored(2)) == (1, 0)
+
+
+def test_reports_flush_pending_logs_on_writer_thread(batch_db, user, monkeypatch):
+    threads = []
+    flush_logs = database.flush_logs
+    def flush_on_thread():
+        threads.append(threading.current_thread().name)
+        return flush_logs()
+    monkeypatch.setattr(database, 'flush_logs', flush_on_thread)
+    database.add_log(user, 'water', 'вода', 300)
+
+    summaries = asyncio.run(async_database.get_daily_summaries(user))
+
+    assert [summary['water_total'] for summary in summaries] == [300]
+    assert threads and all(name.startswith('db-writer') for name in threads)
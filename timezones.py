@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from config import CITY_TIMEZONES, DEFAULT_TIMEZONE
+
+def normalize_city(city):
+    return ' '.join(city.lower().replace('ё', 'е').split())
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except Exception:
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+def timezone_for_city(city):
+    return CITY_TIMEZONES.get(normalize_city(city or ''), DEFAULT_TIMEZONE)
+
+def local_now(timezone_name, moment=None):
+    return (moment or datetime.now(timezone.utc)).astimezone(get_zone(timezone_name))
+
+def local_day(timezone_name, moment=None):
+    return local_now(timezone_name, moment).date().isoformat()
+
+def sqlite_offset(timezone_name, moment=None):
+    # Модификатор для DATE(created_at, ...) по текущему смещению пояса
+    offset = local_now(timezone_name, moment).utcoffset()
+    return f"{int(offset.total_seconds() // 60):+d} minutes"
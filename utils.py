@@ -1,80 +1,349 @@
 ﻿import requests
+import aiohttp
+import asyncio
+import contextvars
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+import database
+import async_database
+import food_store
+from config import FOOD_DB
+from food_matcher import FoodMatcher
+from metrics import EXTERNAL_LATENCY, EXTERNAL_REQUESTS, register_cache
+from timezones import normalize_city
+
 load_dotenv()
 
 OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY', '')
 
+WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+FOOD_SEARCH_URL = "https://world.openfoodfacts.org/cgi/search.pl"
 
-try:
-    from config import FOOD_DB
-except ImportError:
-    FOOD_DB = {
-        'яблоко': 52, 'банан': 96, 'апельсин': 47,
-        'курица': 165, 'говядина': 250,
-        'хлеб': 265, 'рис': 360, 'шоколад': 550
-    }
+HTTP_TIMEOUT = 5
+HTTP_CONNECTION_LIMIT = 100
+HTTP_PER_HOST_LIMIT = 10
 
-def get_weather(city):
-    if not OPENWEATHER_API_KEY or OPENWEATHER_API_KEY.startswith(''):
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 600))
+WEATHER_CACHE_SIZE = int(os.getenv('WEATHER_CACHE_SIZE', 1000))
+
+FOOD_CACHE_TTL = int(os.getenv('FOOD_CACHE_TTL', 30 * 24 * 3600))
+FOOD_CACHE_NEGATIVE_TTL = int(os.getenv('FOOD_CACHE_NEGATIVE_TTL', 24 * 3600))
+
+_http_session = None
+
+_weather_cache = OrderedDict()
+_weather_cache_lock = threading.Lock()
+_weather_inflight = {}
+weather_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'coalesced': 0}
+
+_food_cache = {}
+food_cache_stats = {'hits': 0, 'misses': 0, 'upstream_calls': 0}
+
+
+def _weather_enabled():
+    return bool(OPENWEATHER_API_KEY)
+
+def _weather_cache_get(key):
+    with _weather_cache_lock:
+        entry = _weather_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            _weather_cache.move_to_end(key)
+            weather_cache_stats['hits'] += 1
+            return entry[1]
+        weather_cache_stats['misses'] += 1
+        return None
+
+def _weather_cache_put(key, temp):
+    with _weather_cache_lock:
+        _weather_cache[key] = (time.monotonic() + WEATHER_CACHE_TTL, temp)
+        _weather_cache.move_to_end(key)
+        while len(_weather_cache) > WEATHER_CACHE_SIZE:
+            _weather_cache.popitem(last=False)
+            weather_cache_stats['evictions'] += 1
+
+def get_weather_cache_stats():
+    with _weather_cache_lock:
+        return {**weather_cache_stats, 'size': len(_weather_cache)}
+
+CALORIE_CATEGORIES = {
+    'овощи': 30, 'фрукты': 50, 'мясо': 250, 'рыба': 200,
+    'курица': 165, 'индейка': 135, 'свинина': 242, 'говядина': 250,
+    'хлеб': 265, 'макароны': 370, 'рис': 360, 'картофель': 77,
+    'яйцо': 155, 'молоко': 60, 'сыр': 350, 'творог': 120,
+    'йогурт': 60, 'кефир': 40, 'сметана': 200, 'масло': 750,
+    'орехи': 600, 'шоколад': 550, 'печенье': 450, 'торт': 400
+}
+
+_food_matcher = FoodMatcher(FOOD_DB)
+def _create_food_store_executor():
+    global _food_store_executor
+    # Поиск в офлайн-базе - запрос SQLite FTS, поэтому он идёт в своём потоке, а не в
+    # цикле событий. Соединение с базой одно и под блокировкой: второй поток не нужен
+    _food_store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='food-store')
+
+_create_food_store_executor()
+# Как и пулы async_database, поток не переживает fork в воркер
+os.register_at_fork(after_in_child=_create_food_store_executor)
+# Последний поиск в локальных базах: у каждого апдейта своя задача и свой контекст
+_local_food = contextvars.ContextVar('local_food', default=None)
+_category_matcher = FoodMatcher(CALORIE_CATEGORIES)
+
+def fetch_weather(city):
+    # Как get_weather, но при ошибке запроса возвращает None вместо 20 градусов
+    if not _weather_enabled():
         return 20.0
     
+    key = normalize_city(city)
+    temp = _weather_cache_get(key)
+    if temp is not None:
+        return temp
+    
     try:
         url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
-        response = requests.get(url, timeout=5)
+        response = _requests_get('weather', url)
         
         if response.status_code == 200:
             data = response.json()
-            return data['main']['temp']
+            temp = data['main']['temp']
+            _weather_cache_put(key, temp)
+            return temp
         else:
-            return 20.0
+            return None
     except:
+        return None
+
+def get_weather(city):
+    temp = fetch_weather(city)
+    return temp if temp is not None else 20.0
+
+async def init_http():
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_CONNECTION_LIMIT,
+            limit_per_host=HTTP_PER_HOST_LIMIT,
+            ttl_dns_cache=300,
+            keepalive_timeout=30)
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+    return _http_session
+
+async def close_http():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+def _requests_get(api, url):
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        response = requests.get(url, timeout=5)
+        result = 'ok' if response.status_code == 200 else f'http_{response.status_code}'
+        return response
+    finally:
+        EXTERNAL_LATENCY.observe(time.perf_counter() - start, api)
+        EXTERNAL_REQUESTS.inc(api, result)
+
+async def _get_json(api, url, params):
+    session = _http_session or await init_http()
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        async with session.get(url, params=params) as response:
+            if response.status != 200:
+                result = f'http_{response.status}'
+                return None
+            data = await response.json(content_type=None)
+            result = 'ok'
+            return data
+    finally:
+        EXTERNAL_LATENCY.observe(time.perf_counter() - start, api)
+        EXTERNAL_REQUESTS.inc(api, result)
+
+async def _fetch_weather(city, key):
+    try:
+        data = await _get_json('weather', WEATHER_URL, {'q': city, 'appid': OPENWEATHER_API_KEY, 'units': 'metric'})
+        if not data:
+            return None
+        temp = data['main']['temp']
+    except Exception:
+        return None
+    _weather_cache_put(key, temp)
+    return temp
+
+def _forget_inflight(key, task):
+    if _weather_inflight.get(key) is task:
+        del _weather_inflight[key]
+
+async def get_weather_async(city):
+    if not _weather_enabled():
         return 20.0
+    
+    key = normalize_city(city)
+    temp = _weather_cache_get(key)
+    if temp is not None:
+        return temp
+    
+    # Одновременные запросы по одному городу ждут общий запрос к API
+    task = _weather_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_weather(city, key))
+        _weather_inflight[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+    else:
+        weather_cache_stats['coalesced'] += 1
+    
+    temp = await asyncio.shield(task)
+    return temp if temp is not None else 20.0
 
-def get_calories(food_name):
-    food_lower = food_name.lower()
+def _find_local(food_name):
+    # (ккал на 100 г, продукт офлайн-базы или None). Порядок важен: точное название
+    # из FOOD_DB, затем точное из офлайн-базы, затем частичные совпадения - сначала
+    # со словарём, потом полнотекстовые
+    calories = _food_matcher.exact(food_name)
+    if calories is not None:
+        return calories, None
+    product = food_store.find_exact(food_name)
+    if product:
+        return product['calories'], product
+    calories = _food_matcher.get(food_name)
+    if calories is not None:
+        return calories, None
+    product = food_store.find(food_name)
+    return (product['calories'], product) if product else (None, None)
+
+async def find_local_food(food_name):
+    # Лимитер и /food ищут в одном апдейте один и тот же продукт: второй раз
+    # результат берётся из контекста задачи апдейта
+    cached = _local_food.get()
+    if cached is not None and cached[0] == food_name:
+        return cached[1]
+    calories = _food_matcher.exact(food_name)
+    if calories is not None:
+        result = calories, None
+    else:
+        result = await asyncio.get_running_loop().run_in_executor(_food_store_executor, _find_local, food_name)
+    _local_food.set((food_name, result))
+    return result
+
+def normalize_food(food_name):
+    return ' '.join(food_name.lower().replace('ё', 'е').split())
+
+def _food_cache_expiry(calories, updated_at):
+    return updated_at + (FOOD_CACHE_TTL if calories else FOOD_CACHE_NEGATIVE_TTL)
+
+def _food_cache_get(query):
+    entry = _food_cache.get(query)
+    if entry is None or entry[1] < time.time():
+        food_cache_stats['misses'] += 1
+        return False, None
+    food_cache_stats['hits'] += 1
+    return True, entry[0]
+
+async def food_needs_lookup(food_name):
+    # True, если /food пойдёт во внешний API: продукта нет ни в локальной базе, ни в кэше
+    calories, _ = await find_local_food(food_name)
+    if calories is not None:
+        return False
+    entry = _food_cache.get(normalize_food(food_name))
+    return entry is None or entry[1] < time.time()
+
+def _food_cache_put(query, calories):
+    _food_cache[query] = (calories, _food_cache_expiry(calories, time.time()))
+
+async def warm_food_cache():
+    now = time.time()
+    for query, (calories, updated_at) in (await async_database.load_food_cache()).items():
+        expires_at = _food_cache_expiry(calories, updated_at)
+        if expires_at > now:
+            _food_cache[query] = (calories, expires_at)
+    return len(_food_cache)
+
+def get_food_cache_stats():
+    lookups = food_cache_stats['hits'] + food_cache_stats['misses']
+    return {
+        **food_cache_stats,
+        'size': len(_food_cache),
+        'hit_rate': food_cache_stats['hits'] / lookups if lookups else 0}
+
+register_cache('weather', get_weather_cache_stats)
+register_cache('food', get_food_cache_stats)
+register_cache('daily_totals', lambda: database.daily_cache_stats)
+
+def _calories_from_search(data):
+    products = data.get('products', [])
     
-    for key, calories in FOOD_DB.items():
-        if key in food_lower or food_lower in key:
+    if products:
+        first_product = products[0]
+        calories = first_product.get('nutriments', {}).get('energy-kcal_100g', 0)
+        if calories > 0:
             return calories
+    return None
+
+def get_calories(food_name):
+    calories, _ = _find_local(food_name)
+    if calories is not None:
+        return calories
+    
+    query = normalize_food(food_name)
+    found, calories = _food_cache_get(query)
+    if found:
+        return calories or get_average_calories(food_name)
     
     try:
+        food_cache_stats['upstream_calls'] += 1
         url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={food_name}&json=1"
-        response = requests.get(url, timeout=5)
+        response = _requests_get('food', url)
         
         if response.status_code == 200:
-            data = response.json()
-            products = data.get('products', [])
-            
-            if products:
-                first_product = products[0]
-                calories = first_product.get('nutriments', {}).get('energy-kcal_100g', 0)
-                if calories > 0:
-                    return calories
-                else:
-                    return get_average_calories(food_name)
+            calories = _calories_from_search(response.json())
+            _food_cache_put(query, calories)
+            database.save_food_cache(query, calories)
+            if calories:
+                return calories
     except:
         pass
     
     return get_average_calories(food_name)
 
+async def get_calories_async(food_name):
+    calories, _ = await find_local_food(food_name)
+    if calories is not None:
+        return calories
+    
+    query = normalize_food(food_name)
+    found, calories = _food_cache_get(query)
+    if found:
+        return calories or get_average_calories(food_name)
+    
+    try:
+        food_cache_stats['upstream_calls'] += 1
+        data = await _get_json('food', FOOD_SEARCH_URL, {'search_terms': food_name, 'json': 1})
+        if data:
+            calories = _calories_from_search(data)
+            _food_cache_put(query, calories)
+            await async_database.save_food_cache(query, calories)
+            if calories:
+                return calories
+    except Exception:
+        pass
+    
+    return get_average_calories(food_name)
+
 def get_average_calories(food_name):
     food_lower = food_name.lower()
     
-    categories = {
-        'овощи': 30, 'фрукты': 50, 'мясо': 250, 'рыба': 200,
-        'курица': 165, 'индейка': 135, 'свинина': 242, 'говядина': 250,
-        'хлеб': 265, 'макароны': 370, 'рис': 360, 'картофель': 77,
-        'яйцо': 155, 'молоко': 60, 'сыр': 350, 'творог': 120,
-        'йогурт': 60, 'кефир': 40, 'сметана': 200, 'масло': 750,
-        'орехи': 600, 'шоколад': 550, 'печенье': 450, 'торт': 400
-    }
-    
-    for category, calories in categories.items():
-        if category in food_lower:
-            return calories
+    category = _category_matcher.find(food_name)
+    if category is not None:
+        return CALORIE_CATEGORIES[category]
     
     if 'салат' in food_lower:
         return 100
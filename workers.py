@@ -0,0 +1,198 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import secrets
+import signal
+
+from aiohttp import web
+
+import database
+from metrics import start_metrics_server
+from config import METRICS_HOST, METRICS_PORT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WORKER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Виртуальных узлов на воркер: чем больше, тем ровнее распределение пользователей
+RING_REPLICAS = 100
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+class HashRing:
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        self._ring = sorted((_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self._keys = [h for h, _ in self._ring]
+
+    def node_for(self, key):
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._ring[i][1]
+
+def update_user_id(update):
+    # update - сырой dict от Telegram: {'update_id': ..., 'message': {...}}
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user')
+            if user:
+                return user['id']
+            chat = value.get('chat')
+            if chat:
+                return chat['id']
+    return update.get('update_id', 0)
+
+async def _worker_loop(index, queue):
+    import bot as B
+
+    await B.init_db()
+    await B.init_http()
+    await B.warm_food_cache()
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index, B.refresh_metrics)
+    # Старые логи и состояния анкеты чистит только первый воркер, база у всех общая
+    retention_task = B.start_retention() if index == 0 else None
+    logger.info("👷 Воркер %s запущен", index)
+
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(WORKER_CONCURRENCY)
+    # Последняя задача каждого пользователя: следующий апдейт ждёт её завершения
+    tails = {}
+
+    async def process(user_id, update, previous):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await B.dp.feed_raw_update(B.bot, update)
+            except Exception as e:
+                logger.error("Воркер %s: ошибка обработки апдейта %s: %s", index, update.get('update_id'), e)
+        finally:
+            limit.release()
+
+    def forget(user_id, task):
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    try:
+        while True:
+            # Не больше WORKER_CONCURRENCY апдейтов в работе, включая ждущих
+            # предыдущий апдейт того же пользователя. При всплеске воркер перестаёт
+            # читать, и апдейты ждут в межпроцессной очереди, а не задачами в памяти
+            await limit.acquire()
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                limit.release()
+                break
+
+            user_id = update_user_id(update)
+            task = asyncio.create_task(process(user_id, update, tails.get(user_id)))
+            tails[user_id] = task
+            task.add_done_callback(lambda t, uid=user_id: forget(uid, t))
+
+        if tails:
+            await asyncio.wait(list(tails.values()))
+    finally:
+        if retention_task is not None:
+            retention_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await B.close_db()
+        await B.close_http()
+        await B.bot.session.close()
+        logger.info("👷 Воркер %s остановлен", index)
+
+def _worker_main(index, queue):
+    # Останавливает воркер родитель, отправляя None в очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, queue))
+
+def start_workers(count):
+    # Миграции выполняются один раз до fork, соединения родителя воркерам не достаются
+    database.init_db()
+    database.close_db()
+
+    queues = [multiprocessing.Queue() for _ in range(count)]
+    processes = [multiprocessing.Process(target=_worker_main, args=(i, q), name=f"bot-worker-{i}", daemon=True)
+                 for i, q in enumerate(queues)]
+    for process in processes:
+        process.start()
+    return queues, processes
+
+def stop_workers(queues, processes):
+    for queue in queues:
+        queue.put(None)
+    for process in processes:
+        process.join()
+
+def make_router(queues):
+    ring = HashRing(range(len(queues)))
+
+    def route(update):
+        queues[ring.node_for(update_user_id(update))].put(update)
+    return route
+
+def create_front_app(route, secret_token):
+    async def handle(request):
+        if not secrets.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token):
+            return web.Response(status=401, text="Unauthorized")
+        route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    return app
+
+async def _poll(bot, route, allowed_updates, stop):
+    await bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error("Ошибка получения апдейтов: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            route(update.model_dump(mode='json', exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
+
+async def _front(bot, dp, route, mode):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    allowed_updates = dp.resolve_used_update_types()
+
+    try:
+        if mode == 'webhook':
+            if not WEBHOOK_URL:
+                raise RuntimeError("Для BOT_MODE=webhook нужен WEBHOOK_URL")
+            secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+            runner = web.AppRunner(create_front_app(route, secret_token))
+            await runner.setup()
+            try:
+                await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+                await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                                      secret_token=secret_token, allowed_updates=allowed_updates)
+                await stop.wait()
+            finally:
+                await runner.cleanup()
+        else:
+            poller = asyncio.create_task(_poll(bot, route, allowed_updates, stop))
+            await stop.wait()
+            poller.cancel()
+    finally:
+        await bot.session.close()
+
+def run_workers(bot, dp, count, mode):
+    # Апдейты одного пользователя всегда попадают в один воркер (консистентный
+    # хэш по user_id) и обрабатываются там строго по очереди. Общее состояние
+    # (профили, логи, FSM) живёт в SQLite, а не в памяти процесса
+    queues, processes = start_workers(count)
+    logger.info("🚀 Запущено воркеров: %s, режим: %s", count, mode)
+    try:
+        asyncio.run(_front(bot, dp, make_router(queues), mode))
+    finally:
+        stop_workers(queues, processes)
+        logger.info("🛑 Все воркеры остановлены")